@@ -1,29 +1,256 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Bank, Account, Transaction, BankAccount
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.functional import cached_property
+
+from .budgets import rebuild, record_spend
+from .categorization import recategorize
+from .models import Bank, Account, Transaction, BankAccount, Category, CategoryRule, RecurringTransaction, Budget, BudgetSpend
+from .routers import SHARD_VAR, admin_shard
+from .search import text_filter, tokenize
+from .sharding import ledger_atomic
+from .signals import record_changes
+
+# Largest number of rows the changelist paginator counts exactly
+EXACT_COUNT_LIMIT = 10000
+ACTION_BATCH_SIZE = 2000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for very large tables. An unfiltered changelist on PostgreSQL
+    uses the planner's row estimate; everything else is counted up to
+    EXACT_COUNT_LIMIT rows, so a COUNT(*) never scans millions of rows.
+
+    Past the limit it pages "next page" style: the count always reaches one
+    row beyond the requested page, so that page and a link to the next one
+    exist however deep the list goes.
+    """
+
+    def __init__(self, object_list, per_page, *args, page=1, **kwargs):
+        super().__init__(object_list, per_page, *args, **kwargs)
+        self.requested_page = page
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = max(EXACT_COUNT_LIMIT, self.requested_page * self.per_page) + 1
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 until the table has been analyzed, and may lag behind the table
+            if row and row[0] > limit:
+                return row[0]
+        return queryset.order_by().values('pk')[:limit].count()
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Shard a ledger changelist shows; ShardRouter reads the choice from the request"""
+    title = 'shard'
+    parameter_name = SHARD_VAR
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.DATABASE_SHARDS[1:]]
+
+    def choices(self, changelist):
+        choices = list(super().choices(changelist))
+        choices[0]['display'] = settings.DATABASE_SHARDS[0]  # No choice means 'default', not all shards
+        return choices
+
+    def queryset(self, request, queryset):
+        return queryset
+
+
+def _without_user_joins(paths):
+    """Cut lookups off where they reach auth users, which only exist on 'default'"""
+    kept = []
+    for path in paths:
+        parts = path.split('__')
+        path = '__'.join(parts[:parts.index('user')] if 'user' in parts else parts)
+        if path and path not in kept:
+            kept.append(path)
+    return kept
+
+
+class ShardedAdmin(admin.ModelAdmin):
+    """
+    Admin of a ledger model. With several shards it gets a shard filter, and
+    autocomplete fields become raw id inputs: autocomplete requests do not
+    say which shard the form is editing. On shards other than 'default' list
+    joins and searches stop short of users.
+    """
+
+    def on_other_shard(self, request):
+        return len(settings.DATABASE_SHARDS) > 1 and admin_shard(request) != DEFAULT_DB_ALIAS
+
+    def get_list_select_related(self, request):
+        select_related = super().get_list_select_related(request)
+        if self.on_other_shard(request) and not isinstance(select_related, bool):
+            return _without_user_joins(select_related)
+        return select_related
+
+    def get_search_fields(self, request):
+        search_fields = super().get_search_fields(request)
+        if self.on_other_shard(request):
+            return [field for field in search_fields if 'user' not in field.split('__')]
+        return search_fields
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if len(settings.DATABASE_SHARDS) < 2:
+            return list_filter
+        return [ShardListFilter, *list_filter]
+
+    def get_autocomplete_fields(self, request):
+        return () if len(settings.DATABASE_SHARDS) > 1 else super().get_autocomplete_fields(request)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if len(settings.DATABASE_SHARDS) > 1 and db_field.name in self.autocomplete_fields:
+            kwargs['widget'] = ForeignKeyRawIdWidget(db_field.remote_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class LargeTableAdmin(ShardedAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page = max(int(request.GET.get(PAGE_VAR, 1)), 1)
+        except ValueError:
+            page = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page=page)
+
 
 @admin.register(Bank)
-class BankAdmin(admin.ModelAdmin):
+class BankAdmin(ShardedAdmin):
     list_display = ['name', 'user', 'created_at']
-    list_filter = ['created_at', 'user']
+    list_filter = ['created_at']
+    list_select_related = ['user']
     search_fields = ['name', 'user__username']
+    raw_id_fields = ['user']
     ordering = ['-created_at']
 
 @admin.register(Account)
-class AccountAdmin(admin.ModelAdmin):
+class AccountAdmin(LargeTableAdmin):
     list_display = ['name', 'number', 'bank', 'balance', 'created_at']
-    list_filter = ['bank', 'created_at']
+    list_select_related = ['bank__user']
     search_fields = ['name', 'number', 'bank__name']
+    autocomplete_fields = ['bank']
+    date_hierarchy = 'created_at'
     ordering = ['-created_at']
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
-    list_display = ['description', 'type', 'amount', 'account', 'created_at']
-    list_filter = ['type', 'created_at', 'account__bank']
-    search_fields = ['description', 'account__name', 'recipient_name']
+class TransactionAdmin(LargeTableAdmin):
+    list_display = ['description', 'type', 'amount', 'account', 'category', 'created_at']
+    list_filter = ['type']
+    list_select_related = ['account__bank__user', 'category']
+    # Searched through the full-text index, see get_search_results
+    search_fields = ['description', 'recipient_name', 'recipient_details']
+    search_help_text = 'Matches every word (or word prefix) of the description and recipient.'
+    raw_id_fields = ['user']
+    autocomplete_fields = ['account', 'to_account', 'category']
+    date_hierarchy = 'created_at'
     ordering = ['-created_at']
+    actions = ['apply_category_rules', 'clear_category']
+
+    def save_model(self, request, obj, form, change):
+        # Amount, type, account and category all decide which budgets a transaction counts towards
+        with ledger_atomic():
+            if change:
+                record_spend([Transaction.objects.get(pk=obj.pk)], sign=-1)
+            super().save_model(request, obj, form, change)
+            record_spend([obj])
+
+    def delete_model(self, request, obj):
+        # Queryset deletes (the delete action) are released by core.signals
+        with ledger_atomic():
+            record_spend([obj], sign=-1)
+            super().delete_model(request, obj)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not tokenize(search_term):
+            return queryset, False
+        return queryset.filter(text_filter(search_term, queryset.db)), False
+
+    @admin.action(description='Apply category rules to selected transactions')
+    def apply_category_rules(self, request, queryset):
+        user_ids = queryset.order_by().values_list('user_id', flat=True).distinct()
+        updated = sum(
+            recategorize(user_id, overwrite=True, batch_size=ACTION_BATCH_SIZE, queryset=queryset)
+            for user_id in user_ids
+        )
+        self.message_user(request, f'Categorized {updated} transactions.')
+
+    @admin.action(description='Clear category of selected transactions')
+    def clear_category(self, request, queryset):
+        queryset = queryset.filter(category__isnull=False).order_by()
+        cleared = 0
+        for user_id in queryset.values_list('user_id', flat=True).distinct():
+            ids = list(queryset.filter(user_id=user_id).values_list('id', flat=True))
+            for start in range(0, len(ids), ACTION_BATCH_SIZE):
+                batch = ids[start:start + ACTION_BATCH_SIZE]
+                with transaction.atomic(using=queryset.db):
+                    cleared += Transaction.objects.filter(id__in=batch).update(category=None)
+                    record_changes(user_id, 'transaction', batch)
+            rebuild(Budget.objects.filter(user_id=user_id, category__isnull=False))
+        self.message_user(request, f'Cleared the category of {cleared} transactions.')
+
+@admin.register(Category)
+class CategoryAdmin(ShardedAdmin):
+    list_display = ['name', 'user', 'created_at']
+    list_select_related = ['user']
+    search_fields = ['name', 'user__username']
+    raw_id_fields = ['user']
+    ordering = ['name']
+
+@admin.register(CategoryRule)
+class CategoryRuleAdmin(ShardedAdmin):
+    list_display = ['category', 'rule_type', 'pattern', 'min_amount', 'max_amount', 'priority', 'user']
+    list_filter = ['rule_type']
+    list_select_related = ['category', 'user']
+    search_fields = ['pattern', 'category__name', 'user__username']
+    raw_id_fields = ['user']
+    autocomplete_fields = ['category']
+    ordering = ['user', 'priority']
+
+@admin.register(RecurringTransaction)
+class RecurringTransactionAdmin(ShardedAdmin):
+    list_display = ['description', 'type', 'amount', 'frequency', 'interval', 'next_run_at', 'is_active', 'user']
+    list_filter = ['frequency', 'type', 'is_active']
+    list_select_related = ['user']
+    search_fields = ['description', 'user__username']
+    raw_id_fields = ['user']
+    autocomplete_fields = ['account', 'to_account', 'category']
+    ordering = ['next_run_at']
+
+class BudgetSpendInline(admin.TabularInline):
+    model = BudgetSpend
+    extra = 0
+    readonly_fields = ['month', 'spent']
+    can_delete = False
+
+@admin.register(Budget)
+class BudgetAdmin(ShardedAdmin):
+    list_display = ['name', 'limit', 'category', 'account', 'transaction_type', 'user']
+    list_filter = ['transaction_type']
+    list_select_related = ['category', 'account__bank__user', 'user']
+    search_fields = ['name', 'user__username']
+    raw_id_fields = ['user']
+    autocomplete_fields = ['category', 'account']
+    ordering = ['user', 'name']
+    inlines = [BudgetSpendInline]
 
 # Keep old model registered for migration purposes
 @admin.register(BankAccount)
-class BankAccountAdmin(admin.ModelAdmin):
+class BankAccountAdmin(ShardedAdmin):
     list_display = ['bank_name', 'account_title', 'account_number', 'balance']
     search_fields = ['bank_name', 'account_title', 'account_number']
@@ -0,0 +1,535 @@
+"""
+Query engine for the chat assistant.
+
+parse() maps a question onto an intent (spending, income, top recipients,
+balance or a comparison), the periods it mentions and an optional category,
+account or recipient, using regular expressions only. Whole-month totals are
+read from a per-user monthly rollup; other periods, recipient filters and
+balances use aggregate queries over the (user, created_at) and search
+indexes. The rollup and every answer are cached per ledger version.
+"""
+import hashlib
+import re
+from calendar import month_abbr, month_name
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Case, Count, DecimalField, Q, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce, NullIf, TruncMonth
+from django.utils import timezone
+
+from .budgets import SPEND_TYPES, month_start
+from .metrics import record_cache
+from .models import Account, Category, Transaction
+from .search import text_filter, tokenize
+from .signals import ledger_version
+
+ASSISTANT_CACHE_TIMEOUT = 24 * 60 * 60
+MAX_QUESTION_LENGTH = 500
+DEFAULT_TOP = 5
+MAX_TOP = 20
+
+KIND_TYPES = {'spending': SPEND_TYPES, 'income': ('deposit',)}
+AMOUNT = DecimalField(max_digits=15, decimal_places=2)
+
+EXAMPLES = [
+    'How much did I spend on groceries last month?',
+    'What was my income this year?',
+    'Top 5 recipients in the last 3 months',
+    'What was my balance on 2026-09-30?',
+    'Compare spending this month vs last month',
+]
+
+FULL_MONTHS = {name.lower(): index for index, name in enumerate(month_name) if name}
+MONTHS = {**FULL_MONTHS, **{name.lower(): index for index, name in enumerate(month_abbr) if name}, 'sept': 9}
+_MONTH = '|'.join(sorted(MONTHS, key=len, reverse=True))
+# Abbreviations, "may" and numbers like 2000 are everyday words too, so on their own
+# they only name a period after "in", "during", "for" or "of"; month names also do
+# when followed by a year
+_AFTER_PREPOSITION = r'(?:(?<=\bin )|(?<=\bduring )|(?<=\bfor )|(?<=\bof ))'
+_PLAIN_MONTH = '|'.join(sorted(set(FULL_MONTHS) - {'may'}, key=len, reverse=True))
+_SHORT_MONTH = '|'.join(sorted(set(MONTHS) - set(FULL_MONTHS) | {'may'}, key=len, reverse=True))
+
+DATE_RE = re.compile(
+    r'\b(?:'
+    r'(?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2})'
+    rf'|(?P<day>\d{{1,2}})(?:st|nd|rd|th)? (?:of )?(?P<day_month>{_MONTH})(?: (?P<day_year>\d{{4}}))?'
+    rf'|(?P<month_first>{_MONTH}) (?P<month_day>\d{{1,2}})(?:st|nd|rd|th)?(?: (?P<month_year>\d{{4}}))?'
+    r')\b'
+)
+PERIOD_RE = re.compile(
+    r'\b(?:'
+    r'(?P<relative>today|yesterday)'
+    r'|(?P<which>this|last|previous|current) (?P<unit>week|month|year)'
+    r'|(?:last|past|previous) (?P<count>\d+) (?P<units>day|week|month|year)s?'
+    rf'|(?P<month>{_PLAIN_MONTH})(?: (?P<year_of_month>\d{{4}}))?'
+    rf'|{_AFTER_PREPOSITION}(?P<short_month>{_SHORT_MONTH})'
+    r'(?: (?P<year_of_short>\d{4}))?'
+    rf'|(?P<dated_month>{_SHORT_MONTH}) (?P<year_of_dated>\d{{4}})'
+    rf'|{_AFTER_PREPOSITION}(?P<year>(?:19|20)\d{{2}})'
+    r')\b'
+)
+
+INCOME_RE = re.compile(r'\b(?:income|earn|earned|earnings|receive|received|deposits?|deposited|salary)\b')
+INTENTS = [
+    ('compare', re.compile(r'\b(?:compare|compared|vs|versus)\b|\b(?:more|less)\b.*\bthan\b')),
+    ('top_recipients', re.compile(
+        r'\b(?:top|biggest|largest|most)\b.*\b(?:recipients?|payees?|merchants?|vendors?|shops?|stores?)\b'
+        r'|\bwho did i (?:pay|send)\b|\bwhere did i spend\b'
+    )),
+    ('balance', re.compile(r'\bbalances?\b|\bhow much (?:money )?(?:do|did) i have\b')),
+    ('income', INCOME_RE),
+    ('spending', re.compile(
+        r'\b(?:spend|spent|spending|expenses?|pay|paid|payments?|cost|bought|purchases?)\b'
+    )),
+]
+TARGET_RE = re.compile(r"\b(?:on|at|for|to|from|with)\s+(?P<target>[\w&'. -]+)$")
+ACCOUNT_TARGET_RE = re.compile(r"\b(?:of|in|on|for|at)\s+(?P<target>[\w&'. -]+)$")
+TOP_RE = re.compile(r'\btop (\d+)\b')
+
+END_OF_RE = re.compile(r'\b(?:(?:at|by) the )?end of\b')
+
+# Words left over around a target once the periods are cut out of the question
+STOPWORDS = {
+    'the', 'my', 'in', 'on', 'at', 'for', 'to', 'from', 'during', 'over', 'of', 'and', 'vs', 'versus',
+    'compared', 'than', 'so', 'far', 'total', 'altogether', 'overall', 'was', 'is', 'now', 'today',
+}
+ACCOUNT_STOPWORDS = STOPWORDS | {'account', 'accounts', 'bank'}
+
+
+class Period:
+    """Local dates [start, end)"""
+
+    def __init__(self, start, end, label):
+        self.start, self.end, self.label = start, end, label
+
+    @property
+    def whole_months(self):
+        return self.start.day == 1 and self.end.day == 1
+
+    def previous(self):
+        """The period of the same length right before this one"""
+        if self.whole_months:
+            months = _month_index(self.end) - _month_index(self.start)
+            start = _shift_months(self.start, -months)
+            label = f'in {start:%B %Y}' if months == 1 else f'in the {months} months before'
+            return Period(start, self.start, label)
+        days = (self.end - self.start).days
+        label = 'the day before' if days == 1 else f'in the {days} days before'
+        return Period(self.start - timedelta(days=days), self.start, label)
+
+    def as_dict(self):
+        return {'label': self.label, 'start': self.start, 'end': self.end - timedelta(days=1)}
+
+
+def _month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+def _shift_months(day, months):
+    index = _month_index(day) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _month(day):
+    return Period(day, _shift_months(day, 1), f'in {day:%B %Y}')
+
+
+def _day(day):
+    return Period(day, day + timedelta(days=1), f'on {day:%d %b %Y}')
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _cents(amount):
+    return Decimal(amount or 0).quantize(Decimal('0.01'))
+
+
+def _money(amount):
+    return f'Rs. {amount:,.2f}'
+
+
+def normalize(question):
+    return ' '.join(re.sub(r"[^\w&'\- ]+", ' ', question.lower()).split())
+
+
+def _period(match, today):
+    groups = match.groupdict()
+    month = date(today.year, today.month, 1)
+    if groups['relative']:
+        day = today if groups['relative'] == 'today' else today - timedelta(days=1)
+        return Period(day, day + timedelta(days=1), groups['relative'])
+    if groups['unit']:
+        step = 0 if groups['which'] in ('this', 'current') else -1
+        if groups['unit'] == 'week':
+            start = today - timedelta(days=today.weekday()) + timedelta(weeks=step)
+            return Period(start, start + timedelta(weeks=1), 'this week' if step == 0 else 'last week')
+        if groups['unit'] == 'month':
+            return _month(_shift_months(month, step))
+        year = today.year + step
+        return Period(date(year, 1, 1), date(year + 1, 1, 1), f'in {year}')
+    if groups['units']:
+        count, unit = max(int(groups['count']), 1), groups['units']
+        label = f'in the last {count} {unit}s' if count > 1 else f'in the last {unit}'
+        if unit in ('day', 'week'):
+            days = count * (7 if unit == 'week' else 1)
+            return Period(today - timedelta(days=days - 1), today + timedelta(days=1), label)
+        if unit == 'month':
+            # Whole months including the current one, so totals come from the rollup
+            return Period(_shift_months(month, 1 - count), _shift_months(month, 1), label)
+        return Period(date(today.year - count + 1, 1, 1), date(today.year + 1, 1, 1), label)
+    name = groups['month'] or groups['short_month'] or groups['dated_month']
+    if name:
+        number = MONTHS[name]
+        year = groups['year_of_month'] or groups['year_of_short'] or groups['year_of_dated']
+        if year:
+            year = int(year)
+        else:
+            year = today.year if number <= today.month else today.year - 1  # Most recent one
+        return _month(date(year, number, 1))
+    year = int(groups['year'])
+    return Period(date(year, 1, 1), date(year + 1, 1, 1), f'in {year}')
+
+
+def _date(match, today):
+    groups = match.groupdict()
+    if groups['iso_year']:
+        year, month, day = int(groups['iso_year']), int(groups['iso_month']), int(groups['iso_day'])
+    elif groups['day']:
+        month, day = MONTHS[groups['day_month']], int(groups['day'])
+        year = int(groups['day_year']) if groups['day_year'] else today.year
+    else:
+        month, day = MONTHS[groups['month_first']], int(groups['month_day'])
+        year = int(groups['month_year']) if groups['month_year'] else today.year
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _target(text, pattern, stopwords):
+    match = pattern.search(text)
+    if not match:
+        return None
+    words = match.group('target').split()
+    while words and words[-1] in stopwords:
+        words.pop()
+    while words and words[0] in stopwords:
+        words.pop(0)
+    return ' '.join(words) or None
+
+
+def parse(question, today):
+    """
+    Map a normalized question onto a dict of intent, periods, date, target
+    and top; no database access. Dates count as one-day periods, in the
+    order they appear among the other periods; bad_date holds a date that
+    does not exist, e.g. "2026-02-30".
+    """
+    text = question
+    on_date = bad_date = None
+    found = []
+    for match in DATE_RE.finditer(question):
+        day = _date(match, today)
+        if day is None:
+            bad_date = bad_date or match.group(0)
+        else:
+            on_date = on_date or day
+            found.append((match.start(), _day(day)))
+        # Blank it out in place, so positions of the other periods stay comparable
+        text = text[:match.start()] + ' ' * len(match.group(0)) + text[match.end():]
+    found += [(match.start(), _period(match, today)) for match in PERIOD_RE.finditer(text)]
+    periods = [period for _, period in sorted(found, key=lambda item: item[0])]
+    rest = ' '.join(END_OF_RE.sub(' ', PERIOD_RE.sub(' ', text)).split())
+
+    intent = next((name for name, pattern in INTENTS if pattern.search(question)), 'unknown')
+    if intent == 'balance':
+        target = _target(rest, ACCOUNT_TARGET_RE, ACCOUNT_STOPWORDS)
+    else:
+        target = _target(rest, TARGET_RE, STOPWORDS)
+    top = TOP_RE.search(question)
+    return {
+        'intent': intent,
+        'measure': 'income' if INCOME_RE.search(question) else 'spending',
+        'periods': periods,
+        'date': on_date,
+        'bad_date': bad_date,
+        'target': target,
+        'top': min(max(int(top.group(1)), 1), MAX_TOP) if top else DEFAULT_TOP,
+    }
+
+
+def _singular(text):
+    words = []
+    for word in tokenize(text.lower()):
+        if word.endswith('ies') and len(word) > 4:
+            word = word[:-3] + 'y'
+        elif word.endswith('s') and len(word) > 3 and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def resolve_target(user, target):
+    """A category named like the target, else a text match on descriptions and recipients"""
+    if not target or not tokenize(target):
+        return None
+    wanted = _singular(target)
+    categories = list(Category.objects.filter(user=user).values_list('id', 'name'))
+    for category_id, name in categories:
+        if _singular(name) == wanted:
+            return {'category_id': category_id, 'category_name': name}
+    for category_id, name in sorted(categories, key=lambda item: len(item[1])):
+        if set(wanted) <= set(_singular(name)):
+            return {'category_id': category_id, 'category_name': name}
+    return {'text': target}
+
+
+def monthly_rollup(user, version):
+    """(month, kind, category id) -> (total, count) over the user's whole ledger"""
+    key = f'assistant:rollup:{user.id}:{version}'
+    rollup = cache.get(key)
+    record_cache('assistant_rollup', rollup is not None)
+    if rollup is None:
+        rows = (
+            Transaction.objects.filter(user=user)
+            .annotate(month=TruncMonth('created_at'))
+            .order_by()
+            .values('month', 'type', 'category_id')
+            .annotate(total=Sum(Abs('amount')), count=Count('id'))
+        )
+        rollup = {}
+        for row in rows:
+            for kind, types in KIND_TYPES.items():
+                if row['type'] in types:
+                    entry = (month_start(row['month']), kind, row['category_id'])
+                    total, count = rollup.get(entry, (Decimal(0), 0))
+                    rollup[entry] = (total + row['total'], count + row['count'])
+        cache.set(key, rollup, ASSISTANT_CACHE_TIMEOUT)
+    return rollup
+
+
+def period_total(user, version, kind, period, target=None):
+    """(total, count) of spending or income in a period, optionally for a category or text"""
+    if period.whole_months and (target is None or 'category_id' in target):
+        total, count = Decimal(0), 0
+        for (month, row_kind, category_id), (amount, rows) in monthly_rollup(user, version).items():
+            if row_kind == kind and period.start <= month < period.end and (
+                target is None or category_id == target['category_id']
+            ):
+                total += amount
+                count += rows
+        return _cents(total), count
+
+    queryset = Transaction.objects.filter(
+        user=user, type__in=KIND_TYPES[kind],
+        created_at__gte=_aware(period.start), created_at__lt=_aware(period.end)
+    )
+    if target and 'category_id' in target:
+        queryset = queryset.filter(category_id=target['category_id'])
+    elif target:
+        queryset = queryset.filter(text_filter(target['text'], router.db_for_read(Transaction), user.id))
+    totals = queryset.aggregate(total=Sum(Abs('amount')), count=Count('id'))
+    return _cents(totals['total']), totals['count']
+
+
+def top_recipients(user, period, limit):
+    name = Coalesce(NullIf('recipient_name', Value('')), 'description')
+    rows = (
+        Transaction.objects.filter(
+            user=user, type__in=SPEND_TYPES,
+            created_at__gte=_aware(period.start), created_at__lt=_aware(period.end)
+        )
+        .annotate(name=name)
+        .order_by()
+        .values('name')
+        .annotate(total=Sum(Abs('amount')), count=Count('id'))
+        .order_by('-total', 'name')[:limit]
+    )
+    return [{**row, 'total': _cents(row['total'])} for row in rows]
+
+
+def balance_at(user, account_ids=None, on_date=None):
+    """
+    Balance of the given (or all) accounts at the end of a day, or now. An
+    account opened after that day did not exist yet, so it counts as zero:
+    its opening balance was never booked as a transaction to roll back.
+    """
+    accounts = Account.objects.filter(bank__user=user)
+    if account_ids is not None:
+        accounts = accounts.filter(id__in=account_ids)
+    if on_date is None or on_date >= timezone.localdate():
+        return _cents(accounts.aggregate(total=Sum('balance'))['total'])
+
+    after = _aware(on_date + timedelta(days=1))
+    opened = dict(accounts.filter(created_at__lt=after).values_list('id', 'balance'))
+    current = _cents(sum(opened.values(), Decimal(0)))
+
+    # Roll the current balance back over everything booked after that day. Transfers are
+    # two rows: the outgoing leg (negative, with to_account) and the incoming leg (positive,
+    # without); rows from before that split are one positive row crediting to_account.
+    credit = Q(type='deposit') | Q(type='transfer', to_account__isnull=True)
+    own = Q(account_id__in=opened)
+    incoming = Q(type='transfer', to_account_id__in=opened, amount__gt=0)
+    changes = Transaction.objects.filter(user=user, created_at__gte=after).aggregate(
+        own=Sum(Case(
+            When(own & credit, then=Abs('amount')),
+            When(own, then=-Abs('amount')),
+            default=Value(0), output_field=AMOUNT
+        )),
+        incoming=Sum(Case(When(incoming, then=Abs('amount')), default=Value(0), output_field=AMOUNT)),
+    )
+    return current - _cents(changes['own']) - _cents(changes['incoming'])
+
+
+def _describe(target, kind):
+    if target is None:
+        return ''
+    preposition = 'on' if kind == 'spending' else 'from'
+    if 'category_id' in target:
+        return f" {preposition} {target['category_name']}"
+    return f' {preposition} "{target["text"]}"'
+
+
+def _answer_total(user, version, parsed, today):
+    kind = parsed['intent']
+    period = parsed['periods'][0] if parsed['periods'] else _month(date(today.year, today.month, 1))
+    target = resolve_target(user, parsed['target'])
+    total, count = period_total(user, version, kind, period, target)
+    verb, noun = ('spent', 'transaction') if kind == 'spending' else ('received', 'deposit')
+    return {
+        'answer': f'You {verb} {_money(total)}{_describe(target, kind)} {period.label} '
+                  f'({count} {noun}{"" if count == 1 else "s"}).',
+        'data': {'period': period.as_dict(), 'filter': target, 'total': total, 'count': count},
+    }
+
+
+def _answer_compare(user, version, parsed, today):
+    kind = parsed['measure']
+    periods = parsed['periods'] or [_month(date(today.year, today.month, 1))]
+    first = periods[0]
+    second = periods[1] if len(periods) > 1 else first.previous()
+    target = resolve_target(user, parsed['target'])
+    first_total, _ = period_total(user, version, kind, first, target)
+    second_total, _ = period_total(user, version, kind, second, target)
+
+    difference = first_total - second_total
+    percent = round(float(difference / second_total * 100), 1) if second_total else None
+    verb = 'spent' if kind == 'spending' else 'received'
+    if difference:
+        change = f'{_money(abs(difference))} {"more" if difference > 0 else "less"}'
+        if percent is not None:
+            change += f' ({percent:+.1f}%)'
+    else:
+        change = 'the same amount'
+    return {
+        'answer': f'You {verb} {_money(first_total)}{_describe(target, kind)} {first.label} and '
+                  f'{_money(second_total)} {second.label}: {change}.',
+        'data': {
+            'measure': kind,
+            'filter': target,
+            'periods': [
+                {**first.as_dict(), 'total': first_total},
+                {**second.as_dict(), 'total': second_total},
+            ],
+            'difference': difference,
+            'percent_change': percent,
+        },
+    }
+
+
+def _answer_top(user, parsed, today):
+    period = parsed['periods'][0] if parsed['periods'] else _month(date(today.year, today.month, 1))
+    recipients = top_recipients(user, period, parsed['top'])
+    if recipients:
+        listing = ', '.join(
+            f"{index}. {row['name']} ({_money(row['total'])})" for index, row in enumerate(recipients, 1)
+        )
+        answer = f'Your top recipients {period.label}: {listing}.'
+    else:
+        answer = f'You made no payments {period.label}.'
+    return {'answer': answer, 'data': {'period': period.as_dict(), 'recipients': recipients}}
+
+
+def _answer_balance(user, parsed, today):
+    on_date = parsed['date']
+    if on_date is None and parsed['periods']:
+        on_date = parsed['periods'][0].end - timedelta(days=1)
+    if on_date is not None and on_date >= today:
+        on_date = None
+
+    accounts = None
+    if parsed['target']:
+        words = parsed['target']
+        # Every word must name the bank, the account or its number, e.g. "hbl main"
+        wanted = set(_singular(words))
+        accounts = [
+            row for row in Account.objects.filter(bank__user=user).values('id', 'name', 'number', 'bank__name')
+            if wanted <= set(_singular(f"{row['bank__name']} {row['name']} {row['number']}"))
+        ]
+        if not accounts:
+            return {
+                'answer': f'I could not find an account matching "{words}".',
+                'data': {'date': on_date, 'accounts': [], 'balance': None},
+            }
+
+    balance = balance_at(user, [account['id'] for account in accounts] if accounts else None, on_date)
+    subject = 'Your balance'
+    if accounts:
+        subject = 'The balance of ' + ', '.join(f"{row['bank__name']} {row['name']}" for row in accounts)
+    when = f'at the end of {on_date:%d %b %Y} was' if on_date else 'is'
+    return {
+        'answer': f'{subject} {when} {_money(balance)}.',
+        'data': {
+            'date': on_date,
+            'accounts': [
+                {'id': row['id'], 'name': row['name'], 'bank_name': row['bank__name']} for row in accounts or []
+            ],
+            'balance': balance,
+        },
+    }
+
+
+def answer(user, question, today, version):
+    parsed = parse(question, today)
+    intent = parsed['intent']
+    if parsed['bad_date']:
+        result = {
+            'answer': f'"{parsed["bad_date"]}" is not a date I can look up. Try e.g. 2026-09-30.',
+            'data': {'examples': EXAMPLES},
+        }
+    elif intent in KIND_TYPES:
+        result = _answer_total(user, version, parsed, today)
+    elif intent == 'compare':
+        result = _answer_compare(user, version, parsed, today)
+    elif intent == 'top_recipients':
+        result = _answer_top(user, parsed, today)
+    elif intent == 'balance':
+        result = _answer_balance(user, parsed, today)
+    else:
+        result = {
+            'answer': 'I can answer questions about your spending, income, top recipients, balances '
+                      f'and comparisons between periods, e.g. "{EXAMPLES[0]}"',
+            'data': {'examples': EXAMPLES},
+        }
+    return {'intent': intent, **result}
+
+
+def get_answer(user, question):
+    """Answer a question, served from cache until the user's ledger changes"""
+    version = ledger_version(user.id)
+    today = timezone.localdate()
+    normalized = normalize(question)
+    digest = hashlib.sha1(normalized.encode()).hexdigest()
+    key = f'assistant:{user.id}:{version}:{today:%Y-%m-%d}:{digest}'
+    result = cache.get(key)
+    record_cache('assistant', result is not None)
+    if result is None:
+        result = answer(user, normalized, today, version)
+        result['ledger_version'] = version
+        cache.set(key, result, ASSISTANT_CACHE_TIMEOUT)
+    return {'question': question, **result}
@@ -0,0 +1,174 @@
+"""
+Budgets with incrementally maintained spend counters.
+
+The API views, the scheduler and the admin call record_spend() inside the
+same atomic block that creates, changes or deletes a single spending
+transaction. Queryset deletes and the cascades of account and bank deletes
+are taken out by release_spend() from a pre_delete signal. Bulk updates
+(queryset.update(), bulk_create()) bypass both and must be followed by
+record_spend() or rebuild(), which recomputes counters from scratch for
+repairs and for budgets whose filters changed.
+"""
+from collections import defaultdict, namedtuple
+from datetime import date
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Abs, Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import Budget, BudgetSpend, Transaction
+
+SPEND_TYPES = ('withdrawal', 'external_transfer')
+
+
+def month_start(value):
+    """First day of the month of a date or (aware) datetime"""
+    if hasattr(value, 'tzinfo'):
+        value = timezone.localtime(value) if timezone.is_aware(value) else value
+    return date(value.year, value.month, 1)
+
+
+def _is_spend(txn):
+    # The incoming leg of a transfer (no to_account) credits an account; only the outgoing leg spends
+    return txn.type in SPEND_TYPES or (txn.type == 'transfer' and txn.to_account_id is not None)
+
+
+def _matches(budget, txn):
+    _, _, category_id, account_id, transaction_type = budget
+    if transaction_type:
+        if txn.type != transaction_type:
+            return False
+    elif txn.type not in SPEND_TYPES:
+        return False
+    return (category_id is None or category_id == txn.category_id) and \
+        (account_id is None or account_id == txn.account_id)
+
+
+SpendGroup = namedtuple('SpendGroup', 'user_id type category_id account_id month spent')
+
+
+def record_spend(transactions, sign=1, using=None):
+    """
+    Add (sign=1) or remove (sign=-1) the given transactions from the spend
+    counters of every matching budget. Call inside the writer's atomic block.
+    """
+    transactions = [txn for txn in transactions if _is_spend(txn)]
+    if not transactions:
+        return
+
+    budgets = list(
+        Budget.objects.using(using).filter(user_id__in={txn.user_id for txn in transactions})
+        .values_list('id', 'user_id', 'category_id', 'account_id', 'transaction_type')
+    )
+    if not budgets:
+        return
+
+    budgets_by_user = defaultdict(list)
+    for budget in budgets:
+        budgets_by_user[budget[1]].append(budget)
+
+    increments = defaultdict(int)  # (budget id, month) -> amount
+    for txn in transactions:
+        month = month_start(txn.created_at or timezone.now())
+        for budget in budgets_by_user[txn.user_id]:
+            if _matches(budget, txn):
+                increments[(budget[0], month)] += abs(txn.amount) * sign
+    _apply(increments, using)
+
+
+def _apply(increments, using=None):
+    if not any(increments.values()):
+        return
+    # Make sure every counter row exists, then bump them in place
+    BudgetSpend.objects.using(using).bulk_create(
+        [BudgetSpend(budget_id=budget_id, month=month) for budget_id, month in increments],
+        ignore_conflicts=True
+    )
+    for (budget_id, month), amount in increments.items():
+        if amount:
+            BudgetSpend.objects.using(using).filter(budget_id=budget_id, month=month).update(spent=F('spent') + amount)
+
+
+def _spend_groups(transactions):
+    """Spend of a transaction queryset summed per user, type, category, account and month"""
+    return [
+        SpendGroup(**row) for row in
+        transactions.filter(Q(type__in=SPEND_TYPES) | Q(type='transfer', to_account__isnull=False))
+        .annotate(month=TruncMonth('created_at'))
+        .order_by()
+        .values('user_id', 'type', 'category_id', 'account_id', 'month')
+        .annotate(spent=Sum(Abs('amount')))
+    ]
+
+
+def _budget_spend(budgets, groups):
+    """(budget id, month) -> spend of the groups each budget counts"""
+    spend = defaultdict(int)
+    for budget in budgets:
+        key = (budget.id, budget.user_id, budget.category_id, budget.account_id, budget.transaction_type)
+        for group in groups:
+            if group.user_id == budget.user_id and _matches(key, group):
+                spend[(budget.id, month_start(group.month))] += group.spent
+    return spend
+
+
+def release_spend(transactions, using=None):
+    """
+    Remove transactions that are about to be deleted in bulk, e.g. by an
+    account delete cascading to them, from the counters with one aggregate query
+    """
+    budgets = list(Budget.objects.using(using).filter(user_id__in=transactions.values('user_id')))
+    if budgets:
+        spend = _budget_spend(budgets, _spend_groups(transactions))
+        _apply({key: -amount for key, amount in spend.items()}, using)
+
+
+def rebuild(budgets):
+    """Recompute the spend counters of the given budgets from the ledger, with one query per user"""
+    budgets_by_user = defaultdict(list)
+    for budget in budgets:
+        budgets_by_user[(budget._state.db, budget.user_id)].append(budget)
+
+    for (using, user_id), user_budgets in budgets_by_user.items():
+        groups = _spend_groups(Transaction.objects.using(using).filter(user_id=user_id))
+        spend = _budget_spend(user_budgets, groups)
+        with transaction.atomic(using=using):
+            BudgetSpend.objects.using(using).filter(budget__in=user_budgets).delete()
+            BudgetSpend.objects.using(using).bulk_create([
+                BudgetSpend(budget_id=budget_id, month=month, spent=spent)
+                for (budget_id, month), spent in spend.items()
+            ])
+    return sum(map(len, budgets_by_user.values()))
+
+
+def budget_statuses(user, month=None):
+    """All of a user's budgets with their spend for the month, in a single query"""
+    month = month or month_start(timezone.now())
+    spent = BudgetSpend.objects.filter(budget=OuterRef('pk'), month=month).values('spent')[:1]
+    budgets = (
+        Budget.objects.filter(user=user)
+        .select_related('category', 'account')
+        .annotate(spent=Coalesce(
+            Subquery(spent), Value(0),
+            output_field=DecimalField(max_digits=15, decimal_places=2)
+        ))
+    )
+    return [
+        {
+            'id': budget.id,
+            'name': budget.name,
+            'category_id': budget.category_id,
+            'category_name': budget.category.name if budget.category else None,
+            'account_id': budget.account_id,
+            'account_name': budget.account.name if budget.account else None,
+            'transaction_type': budget.transaction_type or None,
+            'month': f'{month:%Y-%m}',
+            'limit': budget.limit,
+            'spent': budget.spent,
+            'remaining': budget.limit - budget.spent,
+            'percent_used': round(float(budget.spent / budget.limit * 100), 1) if budget.limit else None,
+            'over_limit': budget.spent > budget.limit,
+        }
+        for budget in budgets
+    ]
@@ -0,0 +1,269 @@
+"""
+Rule-based transaction categorization.
+
+A user's CategoryRule rows are compiled into one CategoryMatcher. Substring
+and recipient rules go into one Aho-Corasick automaton per field, so a text
+is scanned once in linear time however many literal rules there are, and the
+winning priority is picked from the matches afterwards. Regex rules are tried
+one at a time in priority order, only while they could still win. Matchers
+are cached per user and rebuilt only when the user's rules change.
+
+Regex rules run server-side on every insert, so they are limited to a subset
+without nested or alternating repetition that can't backtrack exponentially.
+"""
+import re
+from collections import OrderedDict, defaultdict, deque
+
+from django.db.models import Count, Max
+
+from .budgets import rebuild
+from .metrics import record_cache
+from .models import Budget, CategoryRule, Transaction
+from .signals import record_changes
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+RULE_FIELDS = ('id', 'category_id', 'rule_type', 'pattern', 'min_amount', 'max_amount', 'priority')
+
+MAX_REGEX_LENGTH = 100
+MAX_UNBOUNDED_REPEATS = 2  # e.g. "uber.*eats.*" but not ".*a.*b.*c"
+MATCHER_CACHE_SIZE = 1024
+
+REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)}
+ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+
+# user_id -> (rules signature, CategoryMatcher), least recently used first
+_matcher_cache = OrderedDict()
+
+
+def _regex_complexity(parsed, in_repeat=False):
+    """Number of unbounded repeats; raises ValueError for constructs that can backtrack exponentially"""
+    unbounded = 0
+    for op, av in parsed:
+        if op in REPEATS:
+            low, high, body = av
+            if high > 1 and in_repeat:
+                raise ValueError('Nested repetition is not supported')
+            if high == sre_parse.MAXREPEAT:
+                unbounded += 1
+            unbounded += _regex_complexity(body, in_repeat or high > 1)
+        elif op == sre_parse.BRANCH:
+            if in_repeat:
+                raise ValueError('Alternation inside a repetition is not supported')
+            unbounded += sum(_regex_complexity(branch, in_repeat) for branch in av[1])
+        elif op == sre_parse.SUBPATTERN:
+            unbounded += _regex_complexity(av[-1], in_repeat)
+        elif op == ATOMIC_GROUP:
+            unbounded += _regex_complexity(av, in_repeat)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            raise ValueError('Lookarounds are not supported')
+        elif op == sre_parse.GROUPREF_EXISTS:
+            raise ValueError('Conditional groups are not supported')
+    return unbounded
+
+
+def validate_rule_pattern(rule_type, pattern):
+    """Return an error message if the pattern can't be compiled into a matcher, else None"""
+    if rule_type in ('substring', 'recipient'):
+        return None if pattern else 'pattern is required for this rule type'
+    if rule_type != 'regex':
+        return None
+    if not pattern:
+        return 'pattern is required for this rule type'
+    if len(pattern) > MAX_REGEX_LENGTH:
+        return f'Regex must be at most {MAX_REGEX_LENGTH} characters'
+    # Backreferences aren't covered by the repeat analysis below
+    if re.search(r'\(\?P[<=]|\\[1-9]', pattern):
+        return 'Named groups and backreferences are not supported'
+    try:
+        re.compile(pattern, re.IGNORECASE)
+        unbounded = _regex_complexity(sre_parse.parse(pattern))
+    except re.error as e:
+        return f'Invalid regex: {e}'
+    except ValueError as e:
+        return str(e)
+    if unbounded > MAX_UNBOUNDED_REPEATS:
+        return f'At most {MAX_UNBOUNDED_REPEATS} unbounded repeats (*, +, {{n,}}) are supported'
+    return None
+
+
+class _Automaton:
+    """Aho-Corasick automaton over literal patterns that reports the smallest matching key"""
+
+    def __init__(self, patterns):
+        # patterns: (text, key) pairs; keys only need to be comparable
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+        for text, key in patterns:
+            node = 0
+            for char in text.lower():
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(None)
+                node = child
+            if self._best[node] is None or key < self._best[node]:
+                self._best[node] = key
+
+        # Breadth-first, so every fail target is finished before the nodes that use it
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                inherited = self._best[fail]
+                if inherited is not None and (self._best[child] is None or inherited < self._best[child]):
+                    self._best[child] = inherited
+
+    def scan(self, text, best=None, stop=None):
+        """Return the smallest key matching text, or best if that is smaller; stops early at stop"""
+        goto, fail, outputs = self._goto, self._fail, self._best
+        node = 0
+        for char in text.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            key = outputs[node]
+            if key is not None and (best is None or key < best):
+                best = key
+                if best == stop:
+                    break
+        return best
+
+
+class CategoryMatcher:
+    """Picks the category of the highest-priority rule matching a transaction"""
+
+    def __init__(self, rules):
+        # rules: iterables shaped like RULE_FIELDS
+        rules = sorted(rules, key=lambda r: (r[6], r[0]))
+        self._amount_rules = []
+        self._regex_rules = []  # (key, compiled regex) in priority order
+        description_patterns = []
+        recipient_patterns = []
+
+        for rule_id, category_id, rule_type, pattern, min_amount, max_amount, priority in rules:
+            key = (priority, rule_id, category_id)
+            if rule_type == 'amount_range':
+                self._amount_rules.append((key, min_amount, max_amount))
+            elif rule_type == 'regex':
+                if validate_rule_pattern(rule_type, pattern):
+                    continue  # Skip rules saved before validation existed
+                self._regex_rules.append((key, re.compile(pattern, re.IGNORECASE)))
+            elif rule_type == 'recipient':
+                recipient_patterns.append((pattern, key))
+            else:
+                description_patterns.append((pattern, key))
+
+        self._description = _Automaton(description_patterns) if description_patterns else None
+        self._recipient = _Automaton(recipient_patterns) if recipient_patterns else None
+        self._first = (rules[0][6], rules[0][0], rules[0][1]) if rules else None
+
+    def __bool__(self):
+        return self._first is not None
+
+    def _scan(self, automaton, text, best):
+        if automaton is None or not text or best == self._first:
+            return best
+        return automaton.scan(text, best, self._first)
+
+    def match(self, description, recipient_name=None, amount=None):
+        """Return the category id for the given transaction fields, or None"""
+        best = None
+        if amount is not None:
+            amount = abs(amount)
+            for key, min_amount, max_amount in self._amount_rules:
+                if (min_amount is None or amount >= min_amount) and (max_amount is None or amount <= max_amount):
+                    best = key
+                    break
+        best = self._scan(self._description, description, best)
+        best = self._scan(self._recipient, recipient_name, best)
+        if description:
+            for key, regex in self._regex_rules:
+                if best is not None and key >= best:
+                    break
+                if regex.search(description):
+                    best = key
+                    break
+        return best[2] if best else None
+
+
+def compile_rules(rules):
+    return CategoryMatcher(rules)
+
+
+def get_matcher(user_id):
+    """Return the cached matcher for a user, recompiling it if their rules changed"""
+    rules = CategoryRule.objects.filter(user_id=user_id)
+    signature = tuple(rules.aggregate(count=Count('id'), changed=Max('updated_at')).values())
+    cached = _matcher_cache.get(user_id)
+    hit = cached is not None and cached[0] == signature
+    record_cache('category_matcher', hit)
+    if hit:
+        _matcher_cache.move_to_end(user_id)
+        return cached[1]
+
+    matcher = compile_rules(rules.values_list(*RULE_FIELDS))
+    _matcher_cache[user_id] = (signature, matcher)
+    _matcher_cache.move_to_end(user_id)
+    while len(_matcher_cache) > MATCHER_CACHE_SIZE:
+        _matcher_cache.popitem(last=False)
+    return matcher
+
+
+def recategorize(user_id, overwrite=False, batch_size=2000, queryset=None):
+    """
+    Re-run a user's rules over their stored transactions (or the given subset
+    of them) in bulk. Only transactions without a category are touched unless
+    overwrite is set; existing categories are never cleared. Returns the
+    number of rows updated.
+    """
+    matcher = get_matcher(user_id)
+    if not matcher:
+        return 0
+
+    queryset = (Transaction.objects if queryset is None else queryset).filter(user_id=user_id)
+    if not overwrite:
+        queryset = queryset.filter(category__isnull=True)
+    rows = queryset.order_by().values_list(
+        'id', 'description', 'recipient_name', 'amount', 'category_id'
+    ).iterator(chunk_size=batch_size)
+
+    updated = 0
+    pending = defaultdict(list)  # category id -> transaction ids
+    pending_count = 0
+    for txn_id, description, recipient_name, amount, current in rows:
+        category_id = matcher.match(description, recipient_name, amount)
+        if category_id is None or category_id == current:
+            continue
+        pending[category_id].append(txn_id)
+        pending_count += 1
+        if pending_count >= batch_size:
+            updated += _flush(user_id, pending)
+            pending_count = 0
+    updated += _flush(user_id, pending)
+    if updated:
+        # Moving transactions between categories shifts spend between category budgets
+        rebuild(Budget.objects.filter(user_id=user_id, category__isnull=False))
+    return updated
+
+
+def _flush(user_id, pending):
+    updated = 0
+    for category_id, ids in pending.items():
+        updated += Transaction.objects.filter(id__in=ids).update(category_id=category_id)
+        record_changes(user_id, 'transaction', ids)
+    pending.clear()
+    return updated
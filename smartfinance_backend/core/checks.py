@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Replica pins are read by whichever worker serves the user's next request"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    has_replicas = settings.DATABASE_REPLICAS or any(settings.SHARD_REPLICAS.values())
+    if has_replicas and backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            'DATABASE_REPLICAS and SHARD_REPLICAS require a cache shared by all worker processes.',
+            hint='Set SMARTFINANCE_CACHE_DIR or configure Redis or Memcached in CACHES.',
+            obj='settings.CACHES',
+            id='core.E001',
+        )]
+    return []
@@ -0,0 +1,135 @@
+"""
+Idempotency-Key support for endpoints that move money or create records.
+
+The first request with a given key stores its response; a retry with the
+same key and payload gets that response back from a single lookup instead
+of running the view again.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+
+def _fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{payload}'.encode()).hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(lookup, request_hash, now):
+    """
+    Reserve the key for this request. Returns (record, None) when the caller
+    should run the view, or (None, response) when the request must not run.
+    """
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    locked_until = now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+    record = IdempotencyKey.objects.filter(**lookup).first()
+
+    if record is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    **lookup, request_hash=request_hash, expires_at=expires_at, locked_until=locked_until
+                ), None
+        except IntegrityError:
+            # A concurrent retry claimed the key first
+            record = IdempotencyKey.objects.get(**lookup)
+
+    if record.expires_at <= now:
+        # Expired keys may be reused; only one request can take one over
+        taken = IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).update(
+            request_hash=request_hash, response_status=None, response_body=None,
+            expires_at=expires_at, locked_until=locked_until
+        )
+        if taken:
+            record.request_hash, record.response_status, record.expires_at = request_hash, None, expires_at
+            return record, None
+        record = IdempotencyKey.objects.get(pk=record.pk)
+
+    if record.request_hash != request_hash:
+        return None, Response(
+            {'error': 'Idempotency-Key was already used with a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if record.response_status is None:
+        # The request holding the key died without answering once its lease ran out
+        taken = IdempotencyKey.objects.filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lte=now),
+            pk=record.pk, response_status__isnull=True
+        ).update(locked_until=locked_until)
+        if taken:
+            return record, None
+        record = IdempotencyKey.objects.get(pk=record.pk)
+    if record.response_status is None:
+        return None, Response(
+            {'error': 'A request with this Idempotency-Key is still being processed'},
+            status=status.HTTP_409_CONFLICT
+        )
+    return None, _replay(record)
+
+
+def idempotent(scope):
+    """
+    Decorate a DRF view function or view method so that requests carrying an
+    Idempotency-Key header are executed at most once per user, scope and key.
+    Keys sent without authentication are scoped to the client address instead.
+    Server errors are not stored, so the client can retry them.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            request = next(arg for arg in args if isinstance(arg, Request))
+            key = request.META.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view_func(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            if request.user.is_authenticated:
+                lookup = {'user': request.user, 'client': '', 'scope': scope, 'key': key}
+            else:
+                client = BaseThrottle().get_ident(request)[:100]
+                lookup = {'user': None, 'client': client, 'scope': scope, 'key': key}
+            record, response = _claim(lookup, _fingerprint(request), timezone.now())
+            if response is not None:
+                return response
+
+            try:
+                response = view_func(*args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+
+            if response.status_code >= 500:
+                record.delete()
+            else:
+                record.response_status = response.status_code
+                record.response_body = response.data
+                record.locked_until = None
+                record.save(update_fields=['response_status', 'response_body', 'locked_until'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,91 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F
+
+from core.models import Account, Bank, ShardAssignment, Transaction
+from core.routers import use_shard
+from core.sharding import ledger_atomic
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent write throughput with all users on one shard and spread over every shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8, help='Concurrent writers, one user each')
+        parser.add_argument('--transactions', type=int, default=200, help='Transactions written per user')
+
+    def handle(self, *args, **options):
+        shards = settings.DATABASE_SHARDS
+        if len(shards) < 2:
+            raise CommandError('Configure at least two shards, e.g. SMARTFINANCE_SHARDS=4')
+
+        rates = {}
+        layouts = [('1 shard', lambda index: DEFAULT_DB_ALIAS),
+                   (f'{len(shards)} shards', lambda index: shards[index % len(shards)])]
+        for label, placement in layouts:
+            writers = self.create_writers(options['users'], placement)
+            try:
+                written, failed, elapsed = self.run(writers, options['transactions'])
+            finally:
+                User.objects.filter(id__in=[user_id for user_id, _, _ in writers]).delete()
+            rates[label] = written / elapsed
+            self.stdout.write(
+                f'{label}: {written} transactions in {elapsed:.2f}s = {rates[label]:.0f}/s'
+                + (f' ({failed} failed)' if failed else '')
+            )
+
+        single, sharded = rates.values()
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {sharded / single:.2f}x'))
+
+    def create_writers(self, count, placement):
+        run_id = uuid.uuid4().hex[:8]
+        writers = []
+        for index in range(count):
+            user = User.objects.create_user(f'shard-benchmark-{run_id}-{index}')
+            alias = placement(index)
+            ShardAssignment.objects.create(user=user, alias=alias)
+            with use_shard(alias):
+                bank = Bank.objects.create(user=user, name='Benchmark Bank')
+                account = Account.objects.create(bank=bank, name='Benchmark', number=str(index))
+            writers.append((user.id, account.id, alias))
+        return writers
+
+    def run(self, writers, count):
+        results = []
+        threads = [
+            threading.Thread(target=self.write, args=(user_id, account_id, alias, count, results))
+            for user_id, account_id, alias in writers
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return sum(written for written, _ in results), sum(failed for _, failed in results), elapsed
+
+    def write(self, user_id, account_id, alias, count, results):
+        # One short transaction per write, like POST /api/transactions/
+        written = failed = 0
+        try:
+            with use_shard(alias):
+                for index in range(count):
+                    try:
+                        with ledger_atomic():
+                            Transaction.objects.create(
+                                user_id=user_id, account_id=account_id, amount=1,
+                                type='deposit', description=f'Benchmark deposit {index}'
+                            )
+                            Account.objects.filter(pk=account_id).update(balance=F('balance') + 1)
+                        written += 1
+                    except Exception:
+                        failed += 1  # e.g. "database is locked" under contention
+        finally:
+            connections.close_all()
+            results.append((written, failed))
@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.categorization import recategorize
+from core.models import CategoryRule
+from core.routers import use_shard
+from core.sharding import each_shard, shard_for_user
+
+
+class Command(BaseCommand):
+    help = "Apply users' categorization rules to their stored transactions in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only categorize transactions of this username')
+        parser.add_argument(
+            '--overwrite', action='store_true',
+            help='Also re-evaluate transactions that already have a category'
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['user']:
+            try:
+                user_id = User.objects.get(username=options['user']).id
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist")
+            with use_shard(shard_for_user(user_id)):
+                total = self.categorize([user_id], options)
+        else:
+            total = 0
+            for _ in each_shard():
+                # Users without rules have nothing to apply
+                user_ids = CategoryRule.objects.order_by().values_list('user_id', flat=True).distinct()
+                total += self.categorize(list(user_ids), options)
+
+        self.stdout.write(self.style.SUCCESS(f'Categorized {total} transactions'))
+
+    def categorize(self, user_ids, options):
+        return sum(
+            recategorize(user_id, overwrite=options['overwrite'], batch_size=options['batch_size'])
+            for user_id in user_ids
+        )
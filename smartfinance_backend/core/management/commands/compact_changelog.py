@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from core.models import ChangeLog
+from core.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = 'Delete change log entries superseded by a later change to the same row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        # Dropping superseded entries keeps every client token valid: a client
+        # behind an entry still receives the row through its latest change.
+        batch_size = options['batch_size']
+        deleted = 0
+        for _ in each_shard():
+            later = ChangeLog.objects.filter(
+                user_id=OuterRef('user_id'), model=OuterRef('model'),
+                object_id=OuterRef('object_id'), id__gt=OuterRef('id'),
+            )
+            stale = ChangeLog.objects.filter(Exists(later)).order_by('id')
+            while True:
+                ids = list(stale.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                deleted += ChangeLog.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} superseded change log entries'))
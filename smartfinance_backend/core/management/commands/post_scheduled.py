@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.scheduler import post_scheduled
+
+
+class Command(BaseCommand):
+    help = 'Post all due recurring transactions, catching up on missed occurrences (run from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Recurring rules per atomic block')
+
+    def handle(self, *args, **options):
+        posted, deferred = post_scheduled(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Posted {posted} transactions'))
+        if deferred:
+            self.stdout.write(self.style.WARNING(f'{deferred} recurring transactions deferred for insufficient balance'))
@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import ShardAssignment
+from core.sharding import ShardMoveError, hashed_shard, move_user, resume_moves, shard_for_user, start_move
+
+# Users fenced off together, so the drain wait is paid once per group
+FENCE_GROUP_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = "Move users to the shard their id hashes to, or move one user to a given shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Move only this username')
+        parser.add_argument('--to', help='Target shard alias for --user (default: the hashed shard)')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the moves')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        shards = settings.DATABASE_SHARDS
+        if options['to'] and not options['user']:
+            raise CommandError('--to requires --user')
+        if options['to'] and options['to'] not in shards:
+            raise CommandError(f"Unknown shard '{options['to']}', configured: {', '.join(shards)}")
+
+        if not options['dry_run']:
+            resumed = resume_moves(batch_size=options['batch_size'])
+            if resumed:
+                self.stdout.write(f'Completed {resumed} interrupted moves')
+
+        if options['user']:
+            try:
+                user_id = User.objects.get(username=options['user']).id
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist")
+            moves = [(user_id, shard_for_user(user_id), options['to'] or hashed_shard(user_id))]
+        else:
+            # Every user gets an assignment, so users without one are placed now
+            assigned = dict(ShardAssignment.objects.values_list('user_id', 'alias'))
+            moves = []
+            for user_id in User.objects.order_by('id').values_list('id', flat=True).iterator():
+                current = assigned.get(user_id) or shard_for_user(user_id)
+                moves.append((user_id, current, hashed_shard(user_id)))
+
+        moves = [(user_id, source, target) for user_id, source, target in moves if source != target]
+        if options['dry_run']:
+            for user_id, source, target in moves:
+                self.stdout.write(f'User {user_id}: {source} -> {target}')
+            self.stdout.write(self.style.SUCCESS(f'{len(moves)} users would move'))
+            return
+
+        moved_users = moved_rows = 0
+        for start in range(0, len(moves), FENCE_GROUP_SIZE):
+            group = moves[start:start + FENCE_GROUP_SIZE]
+            for user_id, _, target in group:
+                start_move(user_id, target)
+            time.sleep(settings.SHARD_MOVE_DRAIN_SECONDS)
+            for user_id, source, target in group:
+                self.stdout.write(f'User {user_id}: {source} -> {target}')
+                try:
+                    moved_rows += move_user(user_id, target, batch_size=options['batch_size'], drain=False)
+                    moved_users += 1
+                except ShardMoveError as exc:
+                    self.stderr.write(f'{exc}; rerun to retry')
+
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved_users} users ({moved_rows} rows)'))
@@ -0,0 +1,27 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.budgets import rebuild
+from core.models import Budget
+from core.routers import use_shard
+from core.sharding import each_shard, shard_for_user
+
+
+class Command(BaseCommand):
+    help = 'Recompute budget spend counters from the stored transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only rebuild budgets of this username')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist")
+            with use_shard(shard_for_user(user.id)):
+                rebuilt = rebuild(Budget.objects.filter(user=user).iterator())
+        else:
+            rebuilt = sum(rebuild(Budget.objects.all().iterator()) for _ in each_shard())
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} budgets'))
@@ -0,0 +1,290 @@
+"""
+Request, database and cache metrics exposed in the Prometheus text format.
+
+Each worker process keeps its own registry. When settings.METRICS_MULTIPROC_DIR
+is set, every process periodically writes a snapshot of its registry to that
+directory and /metrics sums the snapshots of all processes, so any worker
+behind the load balancer can answer a scrape. Exited processes are folded
+into a single archive snapshot, so counters never go backwards and the
+directory holds one file per live worker.
+"""
+import atexit
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework.views import exception_handler as drf_exception_handler
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'smartfinance_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'smartfinance_http_request_duration_seconds': ('histogram', 'HTTP request latency by route and method'),
+    'smartfinance_http_errors_total': ('counter', 'Requests that raised or returned a 5xx status'),
+    'smartfinance_db_queries_total': ('counter', 'Database queries executed by route'),
+    'smartfinance_db_query_duration_seconds_total': ('counter', 'Time spent in database queries by route'),
+    'smartfinance_api_exceptions_total': ('counter', 'Exceptions handled by the API by route and type'),
+    'smartfinance_cache_requests_total': ('counter', 'Lookups in application caches by cache and result'),
+}
+
+EXITED_FILE = 'metrics-exited.json'  # Totals of processes that are gone
+PROCESS_FILE_RE = re.compile(r'^metrics-(\d+)-[0-9a-f]+\.json$')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._last_flush = 0.0
+        self._timer = None
+        self._closed = False
+        self._pid = None
+        self._filename = None
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(series)] for (name, labels), series in self._histograms.items()],
+            }
+
+    @property
+    def filename(self):
+        """Snapshot file of this process; unique, so a reused pid never overwrites a dead worker's file"""
+        if self._pid != os.getpid():  # Forked workers get their own
+            self._pid, self._filename = os.getpid(), f'metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+        return self._filename
+
+    def flush(self, force=False):
+        """Write this process's snapshot for the other workers to read"""
+        directory = getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+        if not directory or self._closed:
+            return
+        now = time.monotonic()
+        wait = settings.METRICS_FLUSH_INTERVAL - (now - self._last_flush)
+        if not force and wait > 0:
+            self._schedule(wait)
+            return
+        self._last_flush = now
+        _write(directory, self.filename, self.snapshot())
+
+    def _schedule(self, delay):
+        # Write the last requests' metrics even if the worker then sits idle
+        if self._timer is not None and self._timer.is_alive():
+            return
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def close(self):
+        """Fold this process's totals into the exited snapshot and remove its file"""
+        directory = getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+        if not directory:
+            return
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+        snapshot = self.snapshot()
+        with _exited_lock(directory):
+            if snapshot['counters'] or snapshot['histograms']:
+                _fold(directory, [snapshot])
+            _remove(os.path.join(directory, self.filename))
+
+
+registry = MetricsRegistry()
+atexit.register(registry.close)
+
+
+def _write(directory, filename, snapshot):
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, os.path.join(directory, filename))
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # Gone or being replaced by its process right now
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def _exited_lock(directory):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.metrics-exited.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _fold(directory, snapshots):
+    """Add snapshots to the exited totals; call with _exited_lock held"""
+    exited = _read(os.path.join(directory, EXITED_FILE))
+    _write(directory, EXITED_FILE, _merge([exited, *snapshots] if exited else snapshots))
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _reap(directory, filenames):
+    """Fold the files of workers that died without exiting cleanly, e.g. on SIGKILL"""
+    dead = [
+        name for name in filenames
+        if (match := PROCESS_FILE_RE.match(name)) and not _is_alive(int(match.group(1)))
+    ]
+    if not dead:
+        return filenames
+    with _exited_lock(directory):
+        snapshots = [_read(os.path.join(directory, name)) for name in dead]
+        _fold(directory, [snapshot for snapshot in snapshots if snapshot])
+        for name in dead:
+            _remove(os.path.join(directory, name))
+    alive = [name for name in filenames if name not in dead]
+    return alive if EXITED_FILE in alive else [*alive, EXITED_FILE]
+
+
+def record_cache(cache_name, hit):
+    registry.inc('smartfinance_cache_requests_total', {'cache': cache_name, 'result': 'hit' if hit else 'miss'})
+
+
+def _collect_snapshots():
+    snapshots = [registry.snapshot()]
+    directory = getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+    if not directory or not os.path.isdir(directory):
+        return snapshots
+
+    filenames = [
+        filename for filename in os.listdir(directory)
+        if filename.startswith('metrics-') and filename != registry.filename
+    ]
+    for filename in _reap(directory, filenames):
+        snapshot = _read(os.path.join(directory, filename))
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def _merge(snapshots):
+    """Sum snapshots series by series into one snapshot"""
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, series in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(series))
+            for index, value in enumerate(series):
+                merged[index] += value
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), series] for (name, labels), series in histograms.items()],
+    }
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    escaped = (
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    # Full precision: counters stay exact integers and sums keep every digit
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render():
+    """Merge the snapshots of all processes into the Prometheus text format"""
+    merged = _merge(_collect_snapshots())
+    counters = {(name, tuple(map(tuple, labels))): value for name, labels, value in merged['counters']}
+    histograms = {(name, tuple(map(tuple, labels))): series for name, labels, series in merged['histograms']}
+
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        if metric_type == 'counter':
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            continue
+
+        for (series_name, labels), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, series):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(series[-2])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {series[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else '<unmatched>'
+
+
+def exception_handler(exc, context):
+    """DRF exception handler that counts handled API exceptions before delegating"""
+    request = context.get('request')
+    registry.inc('smartfinance_api_exceptions_total', {
+        'route': route_name(request._request) if request is not None else '<unknown>',
+        'exception': type(exc).__name__,
+    })
+    return drf_exception_handler(exc, context)
@@ -0,0 +1,75 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from .metrics import registry, route_name
+from .routers import SAFE_METHODS, pin_to_primary, set_current_request
+
+
+class ReplicaRoutingMiddleware:
+    """Expose the current request to the database router and pin users to the primary after they write"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        set_current_request(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            set_current_request(None)
+
+        # DRF copies the token-authenticated user onto the underlying request
+        user = getattr(request, 'user', None)
+        if request.method not in SAFE_METHODS and user is not None and user.is_authenticated:
+            pin_to_primary(user.id)
+        return response
+
+
+class QueryCounter:
+    """connection.execute_wrapper hook counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """Record per-route request counts, latency, database usage and errors"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(counter))
+                response = self.get_response(request)
+            status_code = response.status_code
+            return response
+        finally:
+            route = route_name(request)
+            registry.inc('smartfinance_http_requests_total', {
+                'route': route, 'method': request.method, 'status': str(status_code)
+            })
+            registry.observe('smartfinance_http_request_duration_seconds', {
+                'route': route, 'method': request.method
+            }, time.perf_counter() - start)
+            registry.inc('smartfinance_db_queries_total', {'route': route}, counter.count)
+            registry.inc('smartfinance_db_query_duration_seconds_total', {'route': route}, counter.duration)
+            if status_code >= 500:
+                registry.inc('smartfinance_http_errors_total', {'route': route})
+            registry.flush()
@@ -0,0 +1,76 @@
+from django.db import migrations
+
+# Frozen copy of the index definition at this point; later changes go in new migrations
+SQLITE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_transaction_fts USING fts5(
+        description, recipient_name, recipient_details,
+        content='core_transaction', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_transaction_fts_ai AFTER INSERT ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(rowid, description, recipient_name, recipient_details)
+        VALUES (new.id, new.description, new.recipient_name, new.recipient_details);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_transaction_fts_ad AFTER DELETE ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(core_transaction_fts, rowid, description, recipient_name, recipient_details)
+        VALUES ('delete', old.id, old.description, old.recipient_name, old.recipient_details);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_transaction_fts_au
+    AFTER UPDATE OF description, recipient_name, recipient_details ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(core_transaction_fts, rowid, description, recipient_name, recipient_details)
+        VALUES ('delete', old.id, old.description, old.recipient_name, old.recipient_details);
+        INSERT INTO core_transaction_fts(rowid, description, recipient_name, recipient_details)
+        VALUES (new.id, new.description, new.recipient_name, new.recipient_details);
+    END
+    """,
+    "INSERT INTO core_transaction_fts(core_transaction_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS core_transaction_fts_ai",
+    "DROP TRIGGER IF EXISTS core_transaction_fts_ad",
+    "DROP TRIGGER IF EXISTS core_transaction_fts_au",
+    "DROP TABLE IF EXISTS core_transaction_fts",
+]
+
+POSTGRES_FTS_SQL = [
+    "CREATE INDEX IF NOT EXISTS core_transaction_search_idx ON core_transaction USING GIN ("
+    "to_tsvector('simple', coalesce(description, '') || ' ' || "
+    "coalesce(recipient_name, '') || ' ' || coalesce(recipient_details, '')))",
+]
+
+POSTGRES_DROP_FTS_SQL = [
+    "DROP INDEX IF EXISTS core_transaction_search_idx",
+]
+
+
+def _execute(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def forwards(apps, schema_editor):
+    _execute(schema_editor, {'sqlite': SQLITE_FTS_SQL, 'postgresql': POSTGRES_FTS_SQL})
+
+
+def backwards(apps, schema_editor):
+    _execute(schema_editor, {'sqlite': SQLITE_DROP_FTS_SQL, 'postgresql': POSTGRES_DROP_FTS_SQL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_transaction_categories'),
+    ]
+
+    operations = [
+        # SQLite: FTS5 table kept in sync by triggers; PostgreSQL: GIN tsvector index
+        migrations.RunPython(forwards, backwards),
+    ]
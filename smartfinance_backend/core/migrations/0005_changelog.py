@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_changelog(apps, schema_editor):
+    """Log every existing row so a client syncing from token 0 receives the whole ledger"""
+    ChangeLog = apps.get_model('core', 'ChangeLog')
+    db = schema_editor.connection.alias
+    sources = [
+        ('bank', apps.get_model('core', 'Bank').objects.using(db).values_list('user_id', 'id')),
+        ('account', apps.get_model('core', 'Account').objects.using(db).values_list('bank__user_id', 'id')),
+        ('category', apps.get_model('core', 'Category').objects.using(db).values_list('user_id', 'id')),
+        ('transaction', apps.get_model('core', 'Transaction').objects.using(db).values_list('user_id', 'id')),
+    ]
+    for model, rows in sources:
+        batch = []
+        for user_id, object_id in rows.order_by('id').iterator(chunk_size=5000):
+            batch.append(ChangeLog(user_id=user_id, model=model, object_id=object_id, action='upsert'))
+            if len(batch) >= 5000:
+                ChangeLog.objects.using(db).bulk_create(batch)
+                batch = []
+        ChangeLog.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0004_transaction_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('bank', 'Bank'), ('account', 'Account'), ('category', 'Category'), ('transaction', 'Transaction')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Created or updated'), ('delete', 'Deleted')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['user', 'id'], name='core_change_user_id_ee010b_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_changelog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Frozen copy of the search triggers from 0004_transaction_search_index
+SQLITE_FTS_TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS core_transaction_fts_ai AFTER INSERT ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(rowid, description, recipient_name, recipient_details)
+        VALUES (new.id, new.description, new.recipient_name, new.recipient_details);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_transaction_fts_ad AFTER DELETE ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(core_transaction_fts, rowid, description, recipient_name, recipient_details)
+        VALUES ('delete', old.id, old.description, old.recipient_name, old.recipient_details);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_transaction_fts_au
+    AFTER UPDATE OF description, recipient_name, recipient_details ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(core_transaction_fts, rowid, description, recipient_name, recipient_details)
+        VALUES ('delete', old.id, old.description, old.recipient_name, old.recipient_details);
+        INSERT INTO core_transaction_fts(rowid, description, recipient_name, recipient_details)
+        VALUES (new.id, new.description, new.recipient_name, new.recipient_details);
+    END
+    """,
+    "INSERT INTO core_transaction_fts(core_transaction_fts) VALUES ('rebuild')",
+]
+
+
+def reinstall_search_index(apps, schema_editor):
+    # SQLite drops the FTS triggers when it remakes core_transaction below
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in SQLITE_FTS_TRIGGERS_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0009_admin_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_index),
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shard_assignment', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('alias', models.CharField(db_index=True, max_length=50)),
+                ('sync_floor', models.BigIntegerField(default=0)),
+                ('moved_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='bank',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='bankaccount',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='budget',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='budgets', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='categories', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='categoryrule',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='category_rules', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='changelog',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='changes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='recurringtransaction',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='recurring_transactions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_per_user_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'created_at'], name='core_transa_user_id_257e65_idx'),
+        ),
+    ]
@@ -0,0 +1,102 @@
+from django.db import migrations
+
+# The FTS table gains a user_id column so MATCH can restrict a search to one
+# user's rows instead of ranking every user's matches first.
+SQLITE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE core_transaction_fts USING fts5(
+        description, recipient_name, recipient_details, user_id,
+        content='core_transaction', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER core_transaction_fts_ai AFTER INSERT ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(rowid, description, recipient_name, recipient_details, user_id)
+        VALUES (new.id, new.description, new.recipient_name, new.recipient_details, new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER core_transaction_fts_ad AFTER DELETE ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(core_transaction_fts, rowid, description, recipient_name, recipient_details, user_id)
+        VALUES ('delete', old.id, old.description, old.recipient_name, old.recipient_details, old.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER core_transaction_fts_au
+    AFTER UPDATE OF description, recipient_name, recipient_details, user_id ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(core_transaction_fts, rowid, description, recipient_name, recipient_details, user_id)
+        VALUES ('delete', old.id, old.description, old.recipient_name, old.recipient_details, old.user_id);
+        INSERT INTO core_transaction_fts(rowid, description, recipient_name, recipient_details, user_id)
+        VALUES (new.id, new.description, new.recipient_name, new.recipient_details, new.user_id);
+    END
+    """,
+    "INSERT INTO core_transaction_fts(core_transaction_fts) VALUES ('rebuild')",
+]
+
+# Definition from 0004_transaction_search_index, for reversing
+SQLITE_PREVIOUS_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE core_transaction_fts USING fts5(
+        description, recipient_name, recipient_details,
+        content='core_transaction', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER core_transaction_fts_ai AFTER INSERT ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(rowid, description, recipient_name, recipient_details)
+        VALUES (new.id, new.description, new.recipient_name, new.recipient_details);
+    END
+    """,
+    """
+    CREATE TRIGGER core_transaction_fts_ad AFTER DELETE ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(core_transaction_fts, rowid, description, recipient_name, recipient_details)
+        VALUES ('delete', old.id, old.description, old.recipient_name, old.recipient_details);
+    END
+    """,
+    """
+    CREATE TRIGGER core_transaction_fts_au
+    AFTER UPDATE OF description, recipient_name, recipient_details ON core_transaction BEGIN
+        INSERT INTO core_transaction_fts(core_transaction_fts, rowid, description, recipient_name, recipient_details)
+        VALUES ('delete', old.id, old.description, old.recipient_name, old.recipient_details);
+        INSERT INTO core_transaction_fts(rowid, description, recipient_name, recipient_details)
+        VALUES (new.id, new.description, new.recipient_name, new.recipient_details);
+    END
+    """,
+    "INSERT INTO core_transaction_fts(core_transaction_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS core_transaction_fts_ai",
+    "DROP TRIGGER IF EXISTS core_transaction_fts_ad",
+    "DROP TRIGGER IF EXISTS core_transaction_fts_au",
+    "DROP TABLE IF EXISTS core_transaction_fts",
+]
+
+
+def _replace(schema_editor, statements):
+    # PostgreSQL filters by user through core_transaction's own indexes
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in SQLITE_DROP_FTS_SQL + statements:
+        schema_editor.execute(sql)
+
+
+def forwards(apps, schema_editor):
+    _replace(schema_editor, SQLITE_FTS_SQL)
+
+
+def backwards(apps, schema_editor):
+    _replace(schema_editor, SQLITE_PREVIOUS_FTS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_transaction_user_created_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_idempotency_key_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shardassignment',
+            name='moving_to',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='shardassignment',
+            name='stale_alias',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='shardassignment',
+            index=models.Index(condition=models.Q(('moving_to', ''), ('stale_alias', ''), _negated=True), fields=['user'], name='core_shard_pending_move_idx'),
+        ),
+    ]
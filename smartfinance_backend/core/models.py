@@ -1,8 +1,12 @@
+import calendar
+from datetime import timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 
 class Bank(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)  # User rows live on 'default', see core.sharding
     name = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -25,6 +29,7 @@ class Account(models.Model):
     class Meta:
         ordering = ['name']
         unique_together = ['bank', 'number']  # Prevent duplicate account numbers per bank
+        indexes = [models.Index(fields=['created_at'])]  # Admin date hierarchy
 
     def __str__(self):
         return f"{self.bank.name} - {self.name} ({self.number})"
@@ -33,6 +38,46 @@ class Account(models.Model):
     def user(self):
         return self.bank.user
 
+class Category(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='categories', db_constraint=False)
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+        unique_together = ['user', 'name']  # Prevent duplicate category names per user
+
+    def __str__(self):
+        return self.name
+
+class CategoryRule(models.Model):
+    RULE_TYPES = (
+        ('substring', 'Description contains'),
+        ('regex', 'Description matches regex'),
+        ('recipient', 'Recipient contains'),
+        ('amount_range', 'Amount in range'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_rules', db_constraint=False)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='rules')
+    rule_type = models.CharField(max_length=20, choices=RULE_TYPES)
+    pattern = models.CharField(max_length=255, blank=True)  # Text or regex for text rules
+
+    # For amount_range rules (compared against the absolute amount)
+    min_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    max_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+
+    priority = models.PositiveIntegerField(default=100)  # Lower value wins
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['priority', 'id']
+
+    def __str__(self):
+        return f"{self.get_rule_type_display()}: {self.pattern or self.category.name}"
+
 class Transaction(models.Model):
     TRANSACTION_TYPES = (
         ('deposit', 'Deposit'),
@@ -41,11 +86,12 @@ class Transaction(models.Model):
         ('external_transfer', 'External Transfer'),
     )
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='transactions')
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
     description = models.CharField(max_length=255)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
 
     # For internal transfers
     to_account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True, related_name='incoming_transfers')
@@ -59,13 +105,197 @@ class Transaction(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),  # Admin date hierarchy
+            models.Index(fields=['user', 'created_at']),  # Per-user date ranges, e.g. assistant queries
+        ]
 
     def __str__(self):
         return f"{self.type.title()}: {self.amount} - {self.description}"
 
+class RecurringTransaction(models.Model):
+    """Template posted as a Transaction on every occurrence by `manage.py post_scheduled`"""
+    FREQUENCIES = (
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+        ('monthly', 'Monthly'),
+        ('yearly', 'Yearly'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recurring_transactions', db_constraint=False)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='recurring_transactions')
+    to_account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True, related_name='incoming_recurring_transactions')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='recurring_transactions')
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    type = models.CharField(max_length=20, choices=Transaction.TRANSACTION_TYPES)
+    description = models.CharField(max_length=255)
+    recipient_name = models.CharField(max_length=100, null=True, blank=True)
+    recipient_details = models.CharField(max_length=255, null=True, blank=True)
+
+    # Schedule: occurrence n happens at start_at + n * interval frequency units
+    frequency = models.CharField(max_length=10, choices=FREQUENCIES)
+    interval = models.PositiveIntegerField(default=1)
+    start_at = models.DateTimeField()
+    end_at = models.DateTimeField(null=True, blank=True)
+
+    occurrences_posted = models.PositiveIntegerField(default=0)
+    next_run_at = models.DateTimeField()
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['next_run_at']
+        indexes = [models.Index(fields=['is_active', 'next_run_at'])]  # Due-rule lookup
+
+    def __str__(self):
+        return f"{self.get_frequency_display()} {self.type}: {self.amount} - {self.description}"
+
+    def occurrence(self, index):
+        """Datetime of the index-th occurrence (0 is start_at)"""
+        steps = index * self.interval
+        if self.frequency == 'daily':
+            return self.start_at + timedelta(days=steps)
+        if self.frequency == 'weekly':
+            return self.start_at + timedelta(weeks=steps)
+        months = steps * 12 if self.frequency == 'yearly' else steps
+        # Anchor on start_at so a rule starting on the 31st stays at month end
+        month_index = self.start_at.month - 1 + months
+        year, month = self.start_at.year + month_index // 12, month_index % 12 + 1
+        day = min(self.start_at.day, calendar.monthrange(year, month)[1])
+        return self.start_at.replace(year=year, month=month, day=day)
+
+class Budget(models.Model):
+    """Monthly spending limit, optionally narrowed to a category, an account and/or a transaction type"""
+    BUDGET_TYPES = (
+        ('withdrawal', 'Withdrawal'),
+        ('transfer', 'Transfer'),
+        ('external_transfer', 'External Transfer'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='budgets', db_constraint=False)
+    name = models.CharField(max_length=100)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='budgets')
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True, related_name='budgets')
+    transaction_type = models.CharField(max_length=20, choices=BUDGET_TYPES, blank=True)  # Empty: withdrawals and external transfers
+    limit = models.DecimalField(max_digits=15, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name}: {self.limit}"
+
+class BudgetSpend(models.Model):
+    """Running spend counter of a budget for one month, updated with every matching transaction"""
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name='spends')
+    month = models.DateField()  # First day of the month
+    spent = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-month']
+        unique_together = ['budget', 'month']
+
+    def __str__(self):
+        return f"{self.budget.name} {self.month:%Y-%m}: {self.spent}"
+
+class ShardAssignment(models.Model):
+    """Database alias that holds a user's ledger; stored on 'default'"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard_assignment')
+    alias = models.CharField(max_length=50, db_index=True)
+    sync_floor = models.BigIntegerField(default=0)  # Sync tokens below this predate the last move
+    moved_at = models.DateTimeField(null=True, blank=True)
+    moving_to = models.CharField(max_length=50, blank=True)  # Set while a move copies the ledger; fences writes
+    stale_alias = models.CharField(max_length=50, blank=True)  # Source copy of a finished move, until deleted
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user'], name='core_shard_pending_move_idx',
+                condition=~models.Q(moving_to='', stale_alias=''),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.alias}"
+
+class ChangeLog(models.Model):
+    """Append-only log of row changes; its id is the monotonic token used by /api/sync/"""
+    MODELS = (
+        ('bank', 'Bank'),
+        ('account', 'Account'),
+        ('category', 'Category'),
+        ('transaction', 'Transaction'),
+    )
+    ACTIONS = (
+        ('upsert', 'Created or updated'),
+        ('delete', 'Deleted'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='changes', db_constraint=False)
+    model = models.CharField(max_length=20, choices=MODELS)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'model', 'object_id']),  # Compaction
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.action} {self.model} {self.object_id}"
+
+class ChangeLogLock(models.Model):
+    """
+    Locked by every change log write of its user until commit, so the user's
+    change ids are handed out in commit order and a sync token never skips a
+    change that commits later under a lower id.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+', db_constraint=False)
+
+    def __str__(self):
+        return f"Change log lock of user {self.user_id}"
+
+class IdempotencyKey(models.Model):
+    """Stored response of a money-moving request, replayed when the client retries with the same key"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='idempotency_keys')  # Empty for anonymous endpoints
+    client = models.CharField(max_length=100, blank=True)  # Client address, scoping keys of anonymous endpoints
+    scope = models.CharField(max_length=50)  # Endpoint the key was used on
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+
+    # Empty while the first request is still being processed
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    locked_until = models.DateTimeField(null=True, blank=True)  # Lease of the running request; a retry may take over after it
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ['user', 'scope', 'key']
+        constraints = [
+            # unique_together doesn't cover rows without a user (NULLs never collide)
+            models.UniqueConstraint(
+                fields=['client', 'scope', 'key'],
+                condition=models.Q(user__isnull=True),
+                name='unique_anonymous_idempotency_key'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}: {self.key}"
+
 # Keep old model for backward compatibility during migration
 class BankAccount(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     bank_name = models.CharField(max_length=100)
     account_title = models.CharField(max_length=100)
     account_number = models.CharField(max_length=30)
@@ -0,0 +1,244 @@
+"""
+Database routers for the core app.
+
+ShardRouter keeps each user's ledger (banks, accounts, transactions and the
+rows hanging off them) on one of settings.DATABASE_SHARDS, see core.sharding;
+auth and the other global tables stay on 'default'.
+
+ReplicaRouter sends reads of core models to one of the aliases listed in
+settings.DATABASE_REPLICAS, the same one for the whole request, and leaves
+writes on 'default'. Reads stay on
+'default' for unsafe requests, inside transactions on 'default', outside of
+a request (management commands, shell) and for a short while after a user's
+own mutation, so users always read their own writes.
+
+With sharding on, ShardRouter answers for ledger models first and applies
+the same rules to the replicas of the chosen shard (settings.SHARD_REPLICAS).
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import QueryDict
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Changelist parameter of the admin's shard filter
+SHARD_VAR = 'shard'
+
+SHARDED_MODELS = {
+    'core.bank', 'core.account', 'core.transaction', 'core.bankaccount', 'core.category',
+    'core.categoryrule', 'core.recurringtransaction', 'core.budget', 'core.budgetspend', 'core.changelog',
+    'core.changeloglock',
+}
+# Migration 0002 creates Transaction as NewTransaction and renames it
+SHARDED_MIGRATION_MODELS = SHARDED_MODELS | {'core.newtransaction'}
+
+_local = threading.local()
+
+
+def set_current_request(request):
+    _local.request = request
+    _local.replicas = {}
+
+
+def get_current_request():
+    return getattr(_local, 'request', None)
+
+
+@contextmanager
+def use_shard(alias):
+    """Route every sharded model to the given alias, e.g. in management commands"""
+    previous = getattr(_local, 'shard', None)
+    _local.shard = alias
+    try:
+        yield
+    finally:
+        _local.shard = previous
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Route this user's reads to the primary until their writes have replicated"""
+    cache.set(_pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def _is_pinned(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    # DRF authenticates inside the view, so only memoize once a user is known
+    if getattr(request, '_replica_pinned_user', None) != user.id:
+        request._replica_pinned_user = user.id
+        request._replica_pinned = bool(cache.get(_pin_key(user.id)))
+    return request._replica_pinned
+
+
+def use_primary(alias=DEFAULT_DB_ALIAS):
+    request = get_current_request()
+    if request is None or request.method not in SAFE_METHODS:
+        return True
+    if connections[alias].in_atomic_block:
+        return True
+    return _is_pinned(request)
+
+
+def replicas_of(alias):
+    if alias == DEFAULT_DB_ALIAS:
+        return settings.DATABASE_REPLICAS
+    return settings.SHARD_REPLICAS.get(alias, [])
+
+
+def primary_of(alias):
+    """The database a replica copies; other aliases are their own primary"""
+    if alias in settings.DATABASE_REPLICAS:
+        return DEFAULT_DB_ALIAS
+    for primary, replicas in settings.SHARD_REPLICAS.items():
+        if alias in replicas:
+            return primary
+    return alias
+
+
+def read_alias(alias):
+    """Where to read data of primary `alias`: one of its replicas when allowed, else the primary"""
+    replicas = replicas_of(alias)
+    if not replicas or use_primary(alias):
+        return alias
+    # One replica per primary and request, so its reads see a single consistent snapshot
+    chosen = getattr(_local, 'replicas', None)
+    if chosen is None:
+        chosen = _local.replicas = {}
+    if chosen.get(alias) not in replicas:
+        chosen[alias] = random.choice(replicas)
+    return chosen[alias]
+
+
+class ReplicaRouter:
+    route_app_labels = {'core'}
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or model._meta.app_label not in self.route_app_labels:
+            return None
+        if hints.get('instance') is not None:
+            return None  # Follow relations on the database the instance came from
+        return read_alias(DEFAULT_DB_ALIAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS if model._meta.app_label in self.route_app_labels else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas carry the full schema so they can be built with migrate --database
+        return None
+
+
+def _request_shard(request):
+    if request is None:
+        return None
+    match = getattr(request, 'resolver_match', None)
+    if match is not None and match.namespace == 'admin':
+        return admin_shard(request)
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    # DRF authenticates inside the view, so only memoize once a user is known
+    if getattr(request, '_shard_user', None) != user.id:
+        from .sharding import ShardMoving, assignment
+        alias, moving_to = assignment(user.id)
+        if moving_to and request.method not in SAFE_METHODS:
+            raise ShardMoving()
+        request._shard_user = user.id
+        request._shard = alias
+    return request._shard
+
+
+def admin_shard(request):
+    """
+    The admin works on one shard at a time: the one picked in the changelist's
+    shard filter (kept in _changelist_filters on change pages), else the one
+    whose id range holds the object being viewed, else 'default'.
+    """
+    shards = settings.DATABASE_SHARDS
+    alias = request.GET.get(SHARD_VAR) or QueryDict(request.GET.get('_changelist_filters', '')).get(SHARD_VAR)
+    if alias in shards:
+        return alias
+    object_id = request.resolver_match.kwargs.get('object_id', '')
+    if object_id.isdigit():
+        from .sharding import SHARD_ID_SPAN
+        index = int(object_id) // SHARD_ID_SPAN
+        if index < len(shards):
+            return shards[index]
+    return DEFAULT_DB_ALIAS
+
+
+class ShardRouter:
+    """
+    The shard of a sharded query comes from, in order: the instance it starts
+    from, use_shard(), a User instance hint and the current request's user.
+    Reads then go to a replica of that shard where ReplicaRouter's rules allow.
+    """
+
+    def _db(self, model, **hints):
+        if len(settings.DATABASE_SHARDS) < 2:
+            return None
+        instance = hints.get('instance')
+        if not is_sharded(model):
+            if instance is not None and is_sharded(instance):
+                return DEFAULT_DB_ALIAS  # e.g. transaction.user: users never live on a shard
+            return None
+
+        if instance is not None and is_sharded(instance) and instance._state.db:
+            return instance._state.db
+        shard = getattr(_local, 'shard', None)
+        if shard:
+            return shard
+        if instance is not None and instance._meta.label_lower == settings.AUTH_USER_MODEL.lower() and instance.pk:
+            request = get_current_request()
+            if getattr(getattr(request, 'user', None), 'id', None) == instance.pk:
+                return _request_shard(request)
+            from .sharding import shard_for_user
+            return shard_for_user(instance.pk)
+        return _request_shard(get_current_request()) or DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        alias = self._db(model, **hints)
+        if alias is None or not is_sharded(model) or hints.get('instance') is not None:
+            return alias
+        return read_alias(alias)
+
+    def db_for_write(self, model, **hints):
+        alias = self._db(model, **hints)
+        return alias and primary_of(alias)  # Instances may have been read from a replica
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if len(settings.DATABASE_SHARDS) < 2:
+            return None
+        if is_sharded(obj1) and is_sharded(obj2):
+            return primary_of(obj1._state.db) == primary_of(obj2._state.db)
+        if is_sharded(obj1) or is_sharded(obj2):
+            return True  # Ledger rows reference their user on 'default'
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        db = primary_of(db)  # Replicas of a shard carry its schema
+        if db == DEFAULT_DB_ALIAS or db not in settings.DATABASE_SHARDS:
+            return None
+        if app_label != 'core':
+            return False
+        if model_name is None:
+            return True  # RunSQL/RunPython, e.g. the search index
+        return f'core.{model_name}' in SHARDED_MIGRATION_MODELS
@@ -0,0 +1,173 @@
+"""
+Posting of recurring transactions.
+
+Due rules are found shard by shard with the (is_active, next_run_at) index
+and posted in batches: each batch runs in one atomic block that locks the
+affected accounts once, bulk-creates every due occurrence (including missed
+ones), applies one aggregated balance update per account and bumps budget
+counters. Transfers are posted as two legs, like AccountViewSet.transfer: a
+negative outgoing row carrying to_account and a positive incoming row on the
+destination account.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import F
+from django.utils import timezone
+
+from .budgets import record_spend
+from .categorization import get_matcher
+from .models import Account, RecurringTransaction, Transaction
+from .sharding import each_shard, fenced_user_ids, ledger_atomic
+from .signals import record_changes
+
+logger = logging.getLogger(__name__)
+
+DEBIT_TYPES = ('withdrawal', 'transfer', 'external_transfer')
+
+
+def due_rule_ids(now, skip_users=()):
+    rules = RecurringTransaction.objects.filter(is_active=True, next_run_at__lte=now)
+    if skip_users:
+        rules = rules.exclude(user_id__in=skip_users)
+    return list(rules.order_by('next_run_at').values_list('id', flat=True))
+
+
+def _due_occurrences(rule, now):
+    """Datetimes of all occurrences that are due but not posted yet"""
+    occurrences = []
+    index = rule.occurrences_posted
+    when = rule.next_run_at
+    while when <= now and (rule.end_at is None or when <= rule.end_at):
+        occurrences.append(when)
+        index += 1
+        when = rule.occurrence(index)
+    return occurrences
+
+
+def post_batch(rule_ids, now):
+    """Post all due occurrences of the given rules. Returns (posted, deferred rules)"""
+    with ledger_atomic():
+        rules = list(
+            RecurringTransaction.objects.select_for_update()
+            .filter(id__in=rule_ids, is_active=True, next_run_at__lte=now)
+            .order_by('next_run_at')
+        )
+        if not rules:
+            return 0, 0
+
+        account_ids = {rule.account_id for rule in rules} | {rule.to_account_id for rule in rules if rule.to_account_id}
+        accounts = Account.objects.select_for_update().select_related('bank').in_bulk(account_ids)
+        balances = {account_id: account.balance for account_id, account in accounts.items()}
+        deltas = defaultdict(Decimal)
+        matchers = {}
+        new_transactions = []
+        deferred = 0
+
+        for rule in rules:
+            occurrences = _due_occurrences(rule, now)
+            if rule.type in DEBIT_TYPES and rule.amount > 0:
+                # Post only what the balance covers; the rest stays due for the next run
+                affordable = int(balances[rule.account_id] // rule.amount)
+                if affordable < len(occurrences):
+                    deferred += 1
+                    logger.warning(
+                        'Recurring transaction %s deferred: insufficient balance for %d occurrence(s)',
+                        rule.id, len(occurrences) - affordable
+                    )
+                    occurrences = occurrences[:max(affordable, 0)]
+
+            total = rule.amount * len(occurrences)
+            if rule.type == 'deposit':
+                deltas[rule.account_id] += total
+                balances[rule.account_id] += total
+            else:
+                deltas[rule.account_id] -= total
+                balances[rule.account_id] -= total
+                if rule.type == 'transfer' and rule.to_account_id:
+                    deltas[rule.to_account_id] += total
+                    balances[rule.to_account_id] += total
+
+            category_id = rule.category_id
+            if category_id is None:
+                if rule.user_id not in matchers:
+                    matchers[rule.user_id] = get_matcher(rule.user_id)
+                category_id = matchers[rule.user_id].match(rule.description, rule.recipient_name, rule.amount)
+
+            is_transfer = rule.type == 'transfer' and rule.to_account_id
+            for when in occurrences:
+                new_transactions.append((when, Transaction(
+                    user_id=rule.user_id,
+                    account_id=rule.account_id,
+                    to_account_id=rule.to_account_id if is_transfer else None,
+                    category_id=category_id,
+                    amount=-rule.amount if is_transfer else rule.amount,
+                    type=rule.type,
+                    description=rule.description,
+                    recipient_name=rule.recipient_name,
+                    recipient_details=rule.recipient_details,
+                )))
+                if is_transfer:
+                    new_transactions.append((when, Transaction(
+                        user_id=rule.user_id,
+                        account_id=rule.to_account_id,
+                        category_id=category_id,
+                        amount=rule.amount,
+                        type=rule.type,
+                        description=rule.description,
+                    )))
+
+            rule.occurrences_posted += len(occurrences)
+            rule.next_run_at = rule.occurrence(rule.occurrences_posted)
+            rule.last_run_at = rule.updated_at = now
+            if rule.end_at is not None and rule.next_run_at > rule.end_at:
+                rule.is_active = False
+
+        created = Transaction.objects.bulk_create([txn for _, txn in new_transactions])
+        # created_at is auto_now_add; backdate missed occurrences to when they were due
+        for (when, _), txn in zip(new_transactions, created):
+            txn.created_at = when
+        Transaction.objects.bulk_update(created, ['created_at'])
+        record_spend(created)
+
+        for account_id, delta in deltas.items():
+            if delta:
+                Account.objects.filter(pk=account_id).update(balance=F('balance') + delta, updated_at=now)
+
+        RecurringTransaction.objects.bulk_update(
+            rules, ['occurrences_posted', 'next_run_at', 'last_run_at', 'is_active', 'updated_at']
+        )
+
+        _log_changes(created, accounts, deltas)
+        return len(created), deferred
+
+
+def _log_changes(created, accounts, deltas):
+    transactions_by_user = defaultdict(list)
+    for txn in created:
+        transactions_by_user[txn.user_id].append(txn.id)
+    for user_id, ids in transactions_by_user.items():
+        record_changes(user_id, 'transaction', ids)
+
+    accounts_by_user = defaultdict(list)
+    for account_id, delta in deltas.items():
+        if delta:
+            accounts_by_user[accounts[account_id].bank.user_id].append(account_id)
+    for user_id, ids in accounts_by_user.items():
+        record_changes(user_id, 'account', ids)
+
+
+def post_scheduled(now=None, batch_size=500):
+    """Post every due recurring transaction. Returns (posted transactions, deferred rules)"""
+    now = now or timezone.now()
+    posted = deferred = 0
+    # Users being moved between shards are posted once the move has finished
+    skip_users = fenced_user_ids()
+    for _ in each_shard():
+        rule_ids = due_rule_ids(now, skip_users)
+        for start in range(0, len(rule_ids), batch_size):
+            batch_posted, batch_deferred = post_batch(rule_ids[start:start + batch_size], now)
+            posted += batch_posted
+            deferred += batch_deferred
+    return posted, deferred
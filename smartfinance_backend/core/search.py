@@ -0,0 +1,131 @@
+"""
+Full-text search over transaction descriptions and recipients.
+
+SQLite keeps an external-content FTS5 table in sync with core_transaction
+through triggers. It indexes user_id as well, so a search only ranks the
+searching user's matches; PostgreSQL uses a GIN index over a tsvector expression.
+Both are created by migrations (0004, 0012_search_index_user_column). Other
+backends fall back to icontains lookups.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Transaction
+
+FTS_TABLE = 'core_transaction_fts'
+SEARCH_COLUMNS = ('description', 'recipient_name', 'recipient_details')
+
+
+def postgres_document(prefix=''):
+    # Must stay identical to the indexed expression for the GIN index to be used
+    return (
+        f"to_tsvector('simple', coalesce({prefix}description, '') || ' ' || "
+        f"coalesce({prefix}recipient_name, '') || ' ' || coalesce({prefix}recipient_details, ''))"
+    )
+
+
+def tokenize(query):
+    return re.findall(r'\w+', query or '')
+
+
+def sqlite_match(terms, user_id=None):
+    """FTS5 query for rows whose text has every term as a word or word prefix"""
+    text = '{%s} : (%s)' % (' '.join(SEARCH_COLUMNS), ' '.join('"%s"*' % term for term in terms))
+    return text if user_id is None else f'user_id : "{int(user_id)}" AND {text}'
+
+
+def search_transactions(user, query, offset=0, limit=20):
+    """
+    Return (total, transactions) for a user's best matches, best first.
+    Every term must match, either as a whole word or as a word prefix.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return 0, []
+
+    conn = connections[router.db_for_read(Transaction)]
+    if conn.vendor == 'sqlite':
+        match = sqlite_match(terms, user.id)
+        from_sql = f"""
+            FROM {FTS_TABLE} f JOIN core_transaction t ON t.id = f.rowid
+            WHERE {FTS_TABLE} MATCH %s AND t.user_id = %s
+        """
+        # Zero weight for the user_id column: it matches every row of the user alike
+        order_sql = f"ORDER BY bm25({FTS_TABLE}, 1.0, 1.0, 1.0, 0.0), t.created_at DESC"
+        params = [match, user.id]
+    elif conn.vendor == 'postgresql':
+        match = ' & '.join('%s:*' % term for term in terms)
+        document = postgres_document('t.')
+        from_sql = f"""
+            FROM core_transaction t
+            WHERE {document} @@ to_tsquery('simple', %s) AND t.user_id = %s
+        """
+        order_sql = f"ORDER BY ts_rank({document}, to_tsquery('simple', %s)) DESC, t.created_at DESC"
+        params = [match, user.id]
+    else:
+        return _search_fallback(user, terms, offset, limit)
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) {from_sql}", params)
+        total = cursor.fetchone()[0]
+        order_params = [match] if conn.vendor == 'postgresql' else []
+        cursor.execute(
+            f"SELECT t.id {from_sql} {order_sql} LIMIT %s OFFSET %s",
+            params + order_params + [limit, offset]
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+
+    return total, _fetch_in_order(ids)
+
+
+def text_filter(query, using, user_id=None):
+    """
+    Q matching transactions whose text contains every term of the query, for
+    filtering aggregates through the search index of database `using`. Pass
+    user_id to keep the index lookup to one user's rows.
+    """
+    terms = tokenize(query)
+    vendor = connections[using].vendor
+    if vendor == 'sqlite':
+        if user_id is None:
+            return Q(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [sqlite_match(terms)]))
+        return Q(id__in=RawSQL(
+            f"SELECT f.rowid FROM {FTS_TABLE} f JOIN core_transaction t ON t.id = f.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND t.user_id = %s",
+            [sqlite_match(terms, user_id), user_id]
+        ))
+    if vendor == 'postgresql':
+        match = ' & '.join('%s:*' % term for term in terms)
+        sql = f"SELECT id FROM core_transaction WHERE {postgres_document()} @@ to_tsquery('simple', %s)"
+        if user_id is None:
+            return Q(id__in=RawSQL(sql, [match]))
+        return Q(id__in=RawSQL(f"{sql} AND user_id = %s", [match, user_id]))
+    combined = _fallback_filter(terms)
+    return combined if user_id is None else combined & Q(user_id=user_id)
+
+
+def _fallback_filter(terms):
+    combined = Q()
+    for term in terms:
+        term_filter = Q()
+        for column in SEARCH_COLUMNS:
+            term_filter |= Q(**{f'{column}__icontains': term})
+        combined &= term_filter
+    return combined
+
+
+def _search_fallback(user, terms, offset, limit):
+    queryset = Transaction.objects.filter(user=user).filter(_fallback_filter(terms))
+    total = queryset.count()
+    ids = list(queryset.values_list('id', flat=True)[offset:offset + limit])
+    return total, _fetch_in_order(ids)
+
+
+def _fetch_in_order(ids):
+    rows = Transaction.objects.select_related(
+        'account', 'account__bank', 'to_account', 'to_account__bank', 'category'
+    ).in_bulk(ids)
+    return [rows[pk] for pk in ids if pk in rows]
@@ -1,7 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework.validators import UniqueValidator
-from .models import Bank, Account, Transaction
+from .models import Bank, Account, Transaction, Category, CategoryRule, RecurringTransaction, Budget
+from .categorization import get_matcher, validate_rule_pattern
 
 class RegisterSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(
@@ -101,30 +103,97 @@ class AccountCreateSerializer(serializers.ModelSerializer):
         validated_data['bank'] = bank
         return super().create(validated_data)
 
+class CategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def validate_name(self, value):
+        user = self.context['request'].user
+        existing = Category.objects.filter(user=user, name=value)
+        if self.instance:
+            existing = existing.exclude(pk=self.instance.pk)
+        if existing.exists():
+            raise serializers.ValidationError("A category with this name already exists.")
+        return value
+
+    def create(self, validated_data):
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
+
+class CategoryRuleSerializer(serializers.ModelSerializer):
+    category_id = serializers.IntegerField()
+    category_name = serializers.CharField(source='category.name', read_only=True)
+
+    class Meta:
+        model = CategoryRule
+        fields = [
+            'id', 'category_id', 'category_name', 'rule_type', 'pattern',
+            'min_amount', 'max_amount', 'priority', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def validate_category_id(self, value):
+        user = self.context['request'].user
+        if not Category.objects.filter(id=value, user=user).exists():
+            raise serializers.ValidationError("Category not found or you don't have permission to access it.")
+        return value
+
+    def validate(self, data):
+        rule_type = data.get('rule_type', getattr(self.instance, 'rule_type', None))
+        pattern = data.get('pattern', getattr(self.instance, 'pattern', ''))
+
+        if rule_type == 'amount_range':
+            min_amount = data.get('min_amount', getattr(self.instance, 'min_amount', None))
+            max_amount = data.get('max_amount', getattr(self.instance, 'max_amount', None))
+            if min_amount is None and max_amount is None:
+                raise serializers.ValidationError("min_amount or max_amount is required for amount_range rules")
+            if min_amount is not None and max_amount is not None and min_amount > max_amount:
+                raise serializers.ValidationError("min_amount cannot be greater than max_amount")
+        else:
+            error = validate_rule_pattern(rule_type, pattern)
+            if error:
+                raise serializers.ValidationError({'pattern': error})
+
+        return data
+
+    def create(self, validated_data):
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
+
 class TransactionSerializer(serializers.ModelSerializer):
     account_name = serializers.CharField(source='account.name', read_only=True)
     bank_name = serializers.CharField(source='account.bank.name', read_only=True)
     to_account_name = serializers.CharField(source='to_account.name', read_only=True)
     to_bank_name = serializers.CharField(source='to_account.bank.name', read_only=True)
+    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), required=False, allow_null=True)
+    category_name = serializers.CharField(source='category.name', read_only=True)
 
     class Meta:
         model = Transaction
         fields = [
             'id', 'amount', 'type', 'description', 'account_name', 'bank_name',
             'to_account_name', 'to_bank_name', 'recipient_name', 'recipient_details',
-            'created_at', 'updated_at'
+            'category', 'category_name', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def validate_category(self, value):
+        if value and value.user_id != self.context['request'].user.id:
+            raise serializers.ValidationError("Category not found or you don't have permission to access it.")
+        return value
+
 class TransactionCreateSerializer(serializers.ModelSerializer):
     account_id = serializers.IntegerField(write_only=True)
     to_account_id = serializers.IntegerField(write_only=True, required=False)
+    category_id = serializers.IntegerField(write_only=True, required=False, allow_null=True)
 
     class Meta:
         model = Transaction
         fields = [
             'account_id', 'amount', 'type', 'description', 'to_account_id',
-            'recipient_name', 'recipient_details'
+            'recipient_name', 'recipient_details', 'category_id'
         ]
 
     def validate(self, data):
@@ -158,4 +227,150 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
             except Account.DoesNotExist:
                 raise serializers.ValidationError("Destination account not found or you don't have permission to access it.")
 
+        category_id = validated_data.pop('category_id', None)
+        if category_id:
+            if not Category.objects.filter(id=category_id, user=user).exists():
+                raise serializers.ValidationError("Category not found or you don't have permission to access it.")
+        else:
+            # Fall back to the user's categorization rules
+            category_id = get_matcher(user.id).match(
+                validated_data.get('description'),
+                validated_data.get('recipient_name'),
+                validated_data.get('amount')
+            )
+        validated_data['category_id'] = category_id
+
         return super().create(validated_data)
+
+class RecurringTransactionSerializer(serializers.ModelSerializer):
+    account_id = serializers.IntegerField()
+    to_account_id = serializers.IntegerField(required=False, allow_null=True)
+    category_id = serializers.IntegerField(required=False, allow_null=True)
+    account_name = serializers.CharField(source='account.name', read_only=True)
+    to_account_name = serializers.CharField(source='to_account.name', read_only=True)
+    is_active = serializers.BooleanField(default=True)  # Form posts would otherwise read a missing flag as False
+
+    SCHEDULE_FIELDS = ('frequency', 'interval', 'start_at')
+
+    class Meta:
+        model = RecurringTransaction
+        fields = [
+            'id', 'account_id', 'account_name', 'to_account_id', 'to_account_name', 'category_id',
+            'amount', 'type', 'description', 'recipient_name', 'recipient_details',
+            'frequency', 'interval', 'start_at', 'end_at', 'is_active',
+            'occurrences_posted', 'next_run_at', 'last_run_at', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'occurrences_posted', 'next_run_at', 'last_run_at', 'created_at', 'updated_at']
+
+    def _owned(self, model, value, lookup, label):
+        if value is None:
+            return value
+        if not model.objects.filter(id=value, **{lookup: self.context['request'].user}).exists():
+            raise serializers.ValidationError(f"{label} not found or you don't have permission to access it.")
+        return value
+
+    def validate_account_id(self, value):
+        return self._owned(Account, value, 'bank__user', 'Account')
+
+    def validate_to_account_id(self, value):
+        return self._owned(Account, value, 'bank__user', 'Destination account')
+
+    def validate_category_id(self, value):
+        return self._owned(Category, value, 'user', 'Category')
+
+    def validate(self, data):
+        if self.instance:
+            changed = [field for field in self.SCHEDULE_FIELDS if field in data and data[field] != getattr(self.instance, field)]
+            if changed:
+                raise serializers.ValidationError(f"{', '.join(changed)} can't be changed; create a new recurring transaction instead")
+
+        transaction_type = data.get('type', getattr(self.instance, 'type', None))
+        account_id = data.get('account_id', getattr(self.instance, 'account_id', None))
+        to_account_id = data.get('to_account_id', getattr(self.instance, 'to_account_id', None))
+        recipient_name = data.get('recipient_name', getattr(self.instance, 'recipient_name', None))
+
+        if data.get('amount') is not None and data['amount'] <= 0:
+            raise serializers.ValidationError("Amount must be positive")
+        if transaction_type == 'transfer' and not to_account_id:
+            raise serializers.ValidationError("to_account_id is required for transfers")
+        if transaction_type == 'transfer' and to_account_id == account_id:
+            raise serializers.ValidationError("Cannot transfer to the same account")
+        if transaction_type == 'external_transfer' and not recipient_name:
+            raise serializers.ValidationError("recipient_name is required for external transfers")
+
+        start_at = data.get('start_at', getattr(self.instance, 'start_at', None))
+        end_at = data.get('end_at', getattr(self.instance, 'end_at', None))
+        if start_at and end_at and end_at < start_at:
+            raise serializers.ValidationError("end_at cannot be before start_at")
+
+        return data
+
+    def create(self, validated_data):
+        validated_data['user'] = self.context['request'].user
+        validated_data['next_run_at'] = validated_data['start_at']
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        if validated_data.get('is_active') and not instance.is_active:
+            # Resuming skips the occurrences missed while paused instead of posting them all at once
+            now = timezone.now()
+            while instance.next_run_at < now:
+                instance.occurrences_posted += 1
+                instance.next_run_at = instance.occurrence(instance.occurrences_posted)
+            if instance.end_at is not None and instance.next_run_at > instance.end_at:
+                validated_data['is_active'] = False  # Ended while paused
+        return super().update(instance, validated_data)
+
+class BudgetSerializer(serializers.ModelSerializer):
+    category_id = serializers.IntegerField(required=False, allow_null=True)
+    account_id = serializers.IntegerField(required=False, allow_null=True)
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    account_name = serializers.CharField(source='account.name', read_only=True)
+
+    class Meta:
+        model = Budget
+        fields = [
+            'id', 'name', 'category_id', 'category_name', 'account_id', 'account_name',
+            'transaction_type', 'limit', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def _owned(self, model, value, lookup, label):
+        if value is None:
+            return value
+        if not model.objects.filter(id=value, **{lookup: self.context['request'].user}).exists():
+            raise serializers.ValidationError(f"{label} not found or you don't have permission to access it.")
+        return value
+
+    def validate_category_id(self, value):
+        return self._owned(Category, value, 'user', 'Category')
+
+    def validate_account_id(self, value):
+        return self._owned(Account, value, 'bank__user', 'Account')
+
+    def validate_limit(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Limit must be positive")
+        return value
+
+    def create(self, validated_data):
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
+
+# --- Flat serializers used by /api/sync/ ---
+class SyncBankSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Bank
+        fields = ['id', 'name', 'created_at', 'updated_at']
+
+class SyncAccountSerializer(AccountSerializer):
+    class Meta(AccountSerializer.Meta):
+        fields = ['id', 'bank_id', 'name', 'number', 'balance', 'created_at', 'updated_at']
+
+class SyncTransactionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Transaction
+        fields = [
+            'id', 'account_id', 'to_account_id', 'category_id', 'amount', 'type', 'description',
+            'recipient_name', 'recipient_details', 'created_at', 'updated_at'
+        ]
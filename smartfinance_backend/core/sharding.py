@@ -0,0 +1,324 @@
+"""
+Per-user sharding of ledger data.
+
+Each user's banks, accounts, transactions and the rows hanging off them live
+on one alias of settings.DATABASE_SHARDS, so a write burst by one user only
+holds the writer lock of their own shard. ShardAssignment on 'default' is the
+source of truth: users who already have data on 'default' stay there, new
+users are placed by a jump consistent hash of their id, and move_user()
+relocates a user. Assignments are read from 'default' once per request
+rather than cached, so a move is seen by every process at once.
+
+Every shard allocates primary keys from its own range of SHARD_ID_SPAN ids,
+so ids are unique across shards and a sync token tells which shard issued
+it. Moved rows get new ids on their new shard.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Max, Min
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import (
+    Account, Bank, BankAccount, Budget, BudgetSpend, Category, CategoryRule, ChangeLog,
+    ChangeLogLock, RecurringTransaction, ShardAssignment, Transaction,
+)
+from .routers import use_shard
+from .signals import CHANGELOG_MODELS, record_changes
+
+SHARD_ID_SPAN = 10 ** 12
+
+# Copy order respects foreign keys; deletion runs in reverse
+LEDGER_MODELS = [
+    Bank, Account, Category, CategoryRule, Transaction, RecurringTransaction, Budget, BudgetSpend, BankAccount,
+]
+SEQUENCE_MODELS = [*LEDGER_MODELS, ChangeLog]
+REFERENCED_MODELS = [Bank, Account, Category, Budget]  # Targets of foreign keys between ledger rows
+OWNER_LOOKUPS = {Account: 'bank__user_id', BudgetSpend: 'budget__user_id'}
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash: going from n to n + 1 buckets only moves 1/(n + 1) of the keys"""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def hashed_shard(user_id):
+    shards = settings.DATABASE_SHARDS
+    return shards[jump_hash(user_id, len(shards))]
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Your data is being moved to another database. Try again shortly.'
+    default_code = 'shard_moving'
+
+
+class ShardMoveError(Exception):
+    pass
+
+
+def shard_for_user(user_id):
+    """Alias of the database holding the user's ledger"""
+    return assignment(user_id)[0]
+
+
+def assignment(user_id):
+    """(alias, moving_to) of the user, placing users seen for the first time"""
+    assignments = ShardAssignment.objects.using(DEFAULT_DB_ALIAS)
+    row = assignments.filter(user_id=user_id).values_list('alias', 'moving_to').first()
+    if row is not None:
+        return row
+    # Users with data from before sharding keep it where it is
+    has_data = any(
+        model.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).exists()
+        for model in (ChangeLog, BankAccount)
+    )
+    alias = DEFAULT_DB_ALIAS if has_data else hashed_shard(user_id)
+    created = assignments.get_or_create(user_id=user_id, defaults={'alias': alias})[0]
+    return created.alias, created.moving_to
+
+
+def fenced_user_ids():
+    """Users with a move in progress or a stale copy left to delete; background jobs skip them"""
+    if len(settings.DATABASE_SHARDS) < 2:
+        return set()
+    return set(
+        ShardAssignment.objects.using(DEFAULT_DB_ALIAS)
+        .exclude(moving_to='', stale_alias='').values_list('user_id', flat=True)
+    )
+
+
+def ledger_atomic():
+    """transaction.atomic() on the database holding the ledger being worked on"""
+    return transaction.atomic(using=router.db_for_write(Transaction))
+
+
+def each_shard():
+    """Yield every shard alias with ledger queries routed to it"""
+    for alias in settings.DATABASE_SHARDS:
+        with use_shard(alias):
+            yield alias
+
+
+def id_range(alias):
+    index = settings.DATABASE_SHARDS.index(alias)
+    return index * SHARD_ID_SPAN, (index + 1) * SHARD_ID_SPAN
+
+
+def sync_token_range(user_id):
+    """(lowest, highest + 1) sync token a client of this user may resume from"""
+    row = (
+        ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id)
+        .values_list('alias', 'sync_floor').first()
+    )
+    alias, floor = row or (DEFAULT_DB_ALIAS, 0)
+    lower, upper = id_range(alias)
+    return max(lower, floor), upper
+
+
+def reserve_id_range(alias):
+    """Start the primary keys of a shard's tables at the beginning of its id range"""
+    lower, _ = id_range(alias)
+    connection = connections[alias]
+    if not lower:
+        return
+    with connection.cursor() as cursor:
+        for model in SEQUENCE_MODELS:
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, lower])
+                elif row[0] < lower:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [lower, table])
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f'SELECT last_value FROM {sequence}')
+                if cursor.fetchone()[0] < lower:
+                    cursor.execute('SELECT setval(%s, %s)', [sequence, lower])
+
+
+def reserve_id_ranges(using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate hook"""
+    if len(settings.DATABASE_SHARDS) > 1 and using in settings.DATABASE_SHARDS:
+        reserve_id_range(using)
+
+
+def _owned(model, user_id, alias):
+    return model._base_manager.using(alias).filter(**{OWNER_LOOKUPS.get(model, 'user_id'): user_id})
+
+
+def _copy(model, objs, alias, id_maps):
+    """Insert rows on another shard under new ids, remapping references to rows copied before"""
+    fields = [field for field in model._meta.local_concrete_fields if not field.primary_key]
+    remaps = [
+        (field.attname, id_maps[field.related_model])
+        for field in fields if field.is_relation and field.related_model in id_maps
+    ]
+    for obj in objs:
+        for attname, mapping in remaps:
+            value = getattr(obj, attname)
+            if value is not None:
+                setattr(obj, attname, mapping[value])
+
+    connection = connections[alias]
+    manager = model._base_manager.using(alias)
+    size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+    if not connection.features.can_return_rows_from_bulk_insert:
+        size = 1
+    new_ids = []
+    for start in range(0, len(objs), size):
+        # raw=True keeps auto_now(_add) timestamps as they are
+        rows = manager._insert(
+            objs[start:start + size], fields=fields, returning_fields=[model._meta.pk], using=alias, raw=True
+        )
+        new_ids.extend(row[0] for row in rows)
+    if model in id_maps:
+        id_maps[model].update(zip((obj.pk for obj in objs), new_ids))
+    return len(objs)
+
+
+def _delete_ledger(user_id, alias):
+    for model in [ChangeLogLock, ChangeLog, *reversed(LEDGER_MODELS)]:
+        _owned(model, user_id, alias)._raw_delete(alias)
+
+
+def _fingerprint(user_id, alias):
+    """Row counts of a user's ledger, plus the last change token on the source of a move"""
+    counts = tuple(_owned(model, user_id, alias).count() for model in LEDGER_MODELS)
+    last_change = ChangeLog.objects.using(alias).filter(user_id=user_id).aggregate(last=Max('id'))['last']
+    return counts, last_change
+
+
+def _set_move(user_id, **fields):
+    ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).update(**fields)
+
+
+def start_move(user_id, target):
+    """Fence off the user's writes ahead of moving them to `target`"""
+    if target not in settings.DATABASE_SHARDS:
+        raise ValueError(f"Unknown shard '{target}'")
+    assignment(user_id)
+    _set_move(user_id, moving_to=target)
+
+
+def finish_stale_copy(user_id):
+    """Delete the source copy a move left behind when it was interrupted after switching"""
+    stale = (
+        ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id)
+        .values_list('stale_alias', flat=True).first()
+    )
+    if stale:
+        with transaction.atomic(using=stale):
+            _delete_ledger(user_id, stale)
+        _set_move(user_id, stale_alias='')
+
+
+def move_user(user_id, target, batch_size=2000, drain=True):
+    """
+    Move a user's ledger to another shard. Returns the number of rows moved.
+
+    Phase one fences off the user's writes (API writes get 503 and the
+    scheduler skips them while ShardAssignment.moving_to is set), waits
+    SHARD_MOVE_DRAIN_SECONDS for writes already in flight unless `drain` is
+    False, and copies the ledger in one transaction on the target. The copy
+    is only committed when its row counts match the source and the source
+    did not change while it was read; otherwise ShardMoveError is raised and
+    the fence is lifted. Phase two switches the assignment, recording the
+    source as stale_alias, and deletes the source copy.
+
+    Both phases can be rerun: a new move of the user first deletes leftovers
+    of an interrupted one, and resume_moves() completes every pending move.
+    """
+    start_move(user_id, target)
+    finish_stale_copy(user_id)
+    source = shard_for_user(user_id)
+    if source == target:
+        _set_move(user_id, moving_to='')
+        return 0
+    if drain:
+        time.sleep(settings.SHARD_MOVE_DRAIN_SECONDS)
+
+    try:
+        moved, floor = _copy_ledger(user_id, source, target, batch_size)
+    except Exception:
+        _set_move(user_id, moving_to='')
+        raise
+
+    _set_move(
+        user_id, alias=target, moving_to='', stale_alias=source, sync_floor=floor, moved_at=timezone.now()
+    )
+    finish_stale_copy(user_id)
+    return moved
+
+
+def _copy_ledger(user_id, source, target, batch_size):
+    moved = 0
+    id_maps = {model: {} for model in REFERENCED_MODELS}
+    with transaction.atomic(using=target):
+        _delete_ledger(user_id, target)  # Leftovers of an interrupted move
+        before = _fingerprint(user_id, source)
+        for model in LEDGER_MODELS:
+            batch = []
+            for obj in _owned(model, user_id, source).order_by('pk').iterator(chunk_size=batch_size):
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    moved += _copy(model, batch, target, id_maps)
+                    batch = []
+            moved += _copy(model, batch, target, id_maps)
+
+        counts, _ = _fingerprint(user_id, target)
+        if _fingerprint(user_id, source) != before or counts != before[0]:
+            raise ShardMoveError(f'User {user_id} changed on {source} while being copied to {target}')
+
+        # Ids and change tokens are new: log every row so clients resync from scratch
+        with use_shard(target):
+            for model, name in CHANGELOG_MODELS.items():
+                ids = list(_owned(model, user_id, target).values_list('id', flat=True))
+                for start in range(0, len(ids), batch_size):
+                    record_changes(user_id, name, ids[start:start + batch_size])
+        floor = ChangeLog.objects.using(target).filter(user_id=user_id).aggregate(floor=Min('id'))['floor'] or 0
+    return moved, floor
+
+
+def resume_moves(batch_size=2000):
+    """Complete the moves interrupted by a crash. Returns the number of users resumed"""
+    pending = list(
+        ShardAssignment.objects.using(DEFAULT_DB_ALIAS).exclude(moving_to='', stale_alias='')
+        .values_list('user_id', 'moving_to')
+    )
+    for user_id, moving_to in pending:
+        if moving_to:
+            # Fenced since the interruption, so there is nothing left in flight
+            move_user(user_id, moving_to, batch_size=batch_size, drain=False)
+        else:
+            finish_stale_copy(user_id)
+    return len(pending)
+
+
+@receiver(pre_delete, sender=User, dispatch_uid='core_shard_user_delete')
+def delete_sharded_ledger(sender, instance, **kwargs):
+    """Django's cascade only reaches rows on the user's own database"""
+    if len(settings.DATABASE_SHARDS) < 2:
+        return
+    row = (
+        ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(user_id=instance.pk)
+        .values_list('alias', 'moving_to', 'stale_alias').first()
+    )
+    # Includes the copies of a move in progress
+    for alias in set(row or ()) - {'', DEFAULT_DB_ALIAS}:
+        with transaction.atomic(using=alias):
+            _delete_ledger(instance.pk, alias)
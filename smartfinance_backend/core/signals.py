@@ -0,0 +1,175 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .budgets import release_spend
+from .models import Account, Bank, Category, ChangeLog, ChangeLogLock, Transaction
+
+CHANGELOG_MODELS = {
+    Bank: 'bank',
+    Account: 'account',
+    Category: 'category',
+    Transaction: 'transaction',
+}
+
+
+def _lock_log(user_id, using):
+    """Hold the user's change log lock until the surrounding transaction commits"""
+    locks = ChangeLogLock.objects.using(using).select_for_update().filter(user_id=user_id)
+    if not locks.values_list('pk', flat=True):
+        try:
+            with transaction.atomic(using=using):
+                ChangeLogLock.objects.using(using).create(user_id=user_id)
+        except IntegrityError:
+            list(locks.values_list('pk', flat=True))  # Created concurrently; wait for it
+
+
+def _log(user_id, entries, using):
+    using = using or router.db_for_write(ChangeLog)
+    with transaction.atomic(using=using):
+        _lock_log(user_id, using)
+        ChangeLog.objects.using(using).bulk_create([
+            ChangeLog(user_id=user_id, model=model, object_id=object_id, action=action)
+            for model, object_id, action in entries
+        ])
+
+
+def record_changes(user_id, model, object_ids, action='upsert', using=None):
+    """Log changes made without model signals, e.g. by queryset.update() or bulk_create()"""
+    _log(user_id, [(model, object_id, action) for object_id in object_ids], using)
+
+
+def ledger_version(user_id):
+    """Latest change token for a user; changes whenever any of their synced rows change"""
+    return ChangeLog.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _owner_id(instance, using):
+    if isinstance(instance, Account):
+        if Account.bank.is_cached(instance):
+            return instance.bank.user_id
+        return Bank.objects.using(using).filter(pk=instance.bank_id).values_list('user_id', flat=True).first()
+    return instance.user_id
+
+
+@receiver(post_save, dispatch_uid='core_changelog_save')
+def log_save(sender, instance, raw=False, using=None, **kwargs):
+    model = CHANGELOG_MODELS.get(sender)
+    if model is None or raw:
+        return
+    user_id = _owner_id(instance, using)
+    if user_id is not None:
+        _log(user_id, [(model, instance.pk, 'upsert')], using)
+
+
+# How to reach each logged model's owner from a queryset of it
+OWNER_FIELDS = {
+    Bank: 'user_id',
+    Account: 'bank__user_id',
+    Category: 'user_id',
+    Transaction: 'user_id',
+}
+
+
+def _deleted_rows(sender, deleted, include_roots, using):
+    """(user id, model, object id) for the rows a delete() of deleted removes, cascades included"""
+    querysets = []
+    if include_roots:
+        querysets.append((sender, deleted))
+    accounts = None
+    if sender is Bank:
+        accounts = Account.objects.using(using).filter(bank__in=deleted)
+        querysets.append((Account, accounts))
+    elif sender is Account:
+        accounts = deleted
+    if accounts is not None:
+        querysets.append((Transaction, Transaction.objects.using(using).filter(
+            Q(account__in=accounts) | Q(to_account__in=accounts)
+        )))
+    for model, queryset in querysets:
+        name = CHANGELOG_MODELS[model]
+        for user_id, object_id in queryset.order_by().values_list(OWNER_FIELDS[model], 'pk'):
+            yield user_id, name, object_id
+
+
+@receiver(pre_delete, sender=Bank, dispatch_uid='core_changelog_cascade_bank')
+@receiver(pre_delete, sender=Account, dispatch_uid='core_changelog_cascade_account')
+@receiver(pre_delete, sender=Category, dispatch_uid='core_changelog_cascade_category')
+@receiver(pre_delete, sender=Transaction, dispatch_uid='core_changelog_cascade_transaction')
+def log_bulk_delete(sender, instance, origin=None, using=None, **kwargs):
+    """
+    Log the rows removed by a queryset delete() or by a cascade once per
+    delete() call, instead of one log write per row from post_delete
+    """
+    if isinstance(origin, QuerySet):
+        if origin.model is not sender or getattr(origin, '_changes_logged', False):
+            return
+        origin._changes_logged = True  # Sent once per instance of the same queryset
+        rows = _deleted_rows(sender, origin, True, using)
+    elif origin is instance and sender in (Bank, Account):
+        rows = _deleted_rows(sender, [instance], False, using)  # log_delete logs the instance itself
+    else:
+        return  # Logged by whoever started the delete; a user's log goes with the user
+
+    entries = defaultdict(list)
+    for user_id, model, object_id in rows:
+        entries[user_id].append((model, object_id, 'delete'))
+    for user_id, user_entries in entries.items():
+        _log(user_id, user_entries, using)
+
+
+@receiver(post_delete, sender=Bank, dispatch_uid='core_changelog_delete_bank')
+@receiver(post_delete, sender=Account, dispatch_uid='core_changelog_delete_account')
+@receiver(post_delete, sender=Category, dispatch_uid='core_changelog_delete_category')
+@receiver(post_delete, sender=Transaction, dispatch_uid='core_changelog_delete_transaction')
+def log_delete(sender, instance, origin=None, using=None, **kwargs):
+    # Cascades and queryset deletes are logged in bulk by log_bulk_delete()
+    if origin is not instance:
+        return
+    user_id = _owner_id(instance, using)
+    if user_id is not None:
+        _log(user_id, [(CHANGELOG_MODELS[sender], instance.pk, 'delete')], using)
+
+
+@receiver(pre_delete, sender=Category, dispatch_uid='core_changelog_category_delete')
+def log_uncategorized(sender, instance, origin=None, using=None, **kwargs):
+    """Deleting a category clears it on its transactions with an UPDATE that sends no signals"""
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is User:
+        return
+    ids = list(Transaction.objects.using(using).filter(category=instance).values_list('id', flat=True))
+    if ids:
+        record_changes(instance.user_id, 'transaction', ids, using=using)
+
+
+@receiver(pre_delete, sender=Bank, dispatch_uid='core_budget_bank_delete')
+@receiver(pre_delete, sender=Account, dispatch_uid='core_budget_account_delete')
+@receiver(pre_delete, sender=Transaction, dispatch_uid='core_budget_transaction_delete')
+def release_deleted_spend(sender, instance, origin=None, using=None, **kwargs):
+    """
+    Transactions deleted by a queryset delete() or by cascade from their
+    account or bank bypass record_spend(); take their spend out of the
+    budgets once per delete() call
+    """
+    if isinstance(origin, QuerySet):
+        if origin.model is not sender or getattr(origin, '_spend_released', False):
+            return
+        origin._spend_released = True  # Sent once per instance of the same queryset
+        deleted = origin
+    elif origin is instance and sender is not Transaction:
+        deleted = [instance]
+    else:
+        return  # Single transactions are released by their caller; a user's budgets go with the user
+
+    if sender is Transaction:
+        transactions = deleted
+    else:
+        via = 'bank__' if sender is Bank else ''
+        transactions = Transaction.objects.using(using).filter(
+            Q(**{f'account__{via}in': deleted}) | Q(**{f'to_account__{via}in': deleted})
+        )
+    release_spend(transactions, using)
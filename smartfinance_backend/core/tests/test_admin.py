@@ -0,0 +1,93 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+
+from core import admin as core_admin
+from core.models import Account, Bank, Budget, BudgetSpend, Transaction
+
+
+class TransactionAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', password='x')
+        self.client.force_login(self.admin)
+        self.user = User.objects.create_user('alice', password='x')
+        bank = Bank.objects.create(user=self.user, name='HBL')
+        self.account = Account.objects.create(bank=bank, name='Groceries card', number='1')
+
+    def add(self, count, description='Coffee'):
+        Transaction.objects.bulk_create(
+            Transaction(user=self.user, account=self.account, amount=1, type='withdrawal', description=description)
+            for _ in range(count)
+        )
+
+    def changelist(self, **params):
+        response = self.client.get('/admin/core/transaction/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_pages_past_the_count_limit_stay_reachable(self):
+        self.add(35)
+        with mock.patch.object(core_admin, 'EXACT_COUNT_LIMIT', 10), \
+                mock.patch.object(core_admin.TransactionAdmin, 'list_per_page', 5):
+            first = self.changelist()
+            self.assertEqual(first.paginator.num_pages, 3)
+            deep = self.changelist(p=5)
+            self.assertEqual(len(deep.result_list), 5)
+            self.assertEqual(deep.paginator.num_pages, 6)
+            last = self.changelist(p=7)
+            self.assertEqual((len(last.result_list), last.paginator.num_pages), (5, 7))
+
+    def test_search_uses_the_text_index_not_the_account_name(self):
+        self.add(2, 'Coffee at Gloria Jeans')
+        self.add(1, 'Rent')
+        self.assertEqual(self.changelist(q='glor coff').result_count, 2)
+        self.assertEqual(self.changelist(q='groceries').result_count, 0)
+        self.assertEqual(self.changelist(q='  ').result_count, 3)
+
+
+class TransactionAdminSpendTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', password='x')
+        self.client.force_login(self.admin)
+        self.user = User.objects.create_user('alice', password='x')
+        bank = Bank.objects.create(user=self.user, name='HBL')
+        self.account = Account.objects.create(bank=bank, name='Current', number='1')
+        self.budget = Budget.objects.create(user=self.user, name='All', limit=500)
+        self.model_admin = admin.site._registry[Transaction]
+        self.request = RequestFactory().post('/admin/core/transaction/')
+        self.request.user = self.admin
+
+    def spend(self):
+        return sum(BudgetSpend.objects.filter(budget=self.budget).values_list('spent', flat=True), Decimal(0))
+
+    def save(self, txn, change):
+        self.model_admin.save_model(self.request, txn, None, change)
+
+    def test_saving_and_deleting_adjust_the_counters(self):
+        txn = Transaction(user=self.user, account=self.account, amount=30, type='withdrawal')
+        self.save(txn, False)
+        self.assertEqual(self.spend(), 30)
+        txn.amount = 45
+        self.save(txn, True)
+        self.assertEqual(self.spend(), 45)
+        txn.type = 'deposit'
+        self.save(txn, True)
+        self.assertEqual(self.spend(), 0)
+        txn.type = 'withdrawal'
+        self.save(txn, True)
+        self.model_admin.delete_model(self.request, txn)
+        self.assertEqual(self.spend(), 0)
+
+    def test_delete_action_releases_the_selected_spend(self):
+        txns = [Transaction(user=self.user, account=self.account, amount=10, type='withdrawal') for _ in range(3)]
+        for txn in txns:
+            self.save(txn, False)
+        response = self.client.post('/admin/core/transaction/', {
+            'action': 'delete_selected', '_selected_action': [txns[0].pk, txns[1].pk], 'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(self.spend(), 10)
@@ -0,0 +1,78 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from core.analytics import Ledger, _local_days, detect_recurring
+from core.models import Account, Bank, Transaction
+
+TODAY = date(2026, 10, 19)
+
+
+def expense(day, amount, payee):
+    return (day, float(amount), 1, 1, 0, payee)
+
+
+class DetectRecurringTests(SimpleTestCase):
+    def test_finds_regular_payments_by_period(self):
+        rows = [expense(date(2026, 1, 5) + timedelta(days=30 * n), 15, 'Netflix 4471') for n in range(6)]
+        rows += [expense(date(2026, 7, 1) + timedelta(days=7 * n), 20, 'GYM') for n in range(8)]
+        rows += [expense(date(2026, 3, 1) + timedelta(days=n * n), 5, 'Kiosk') for n in range(8)]
+        rows.sort()
+        recurring = detect_recurring(Ledger(rows), TODAY)
+        self.assertEqual([(item['period'], item['occurrences']) for item in recurring], [('weekly', 8), ('monthly', 6)])
+        self.assertEqual(recurring[1]['name'], 'Netflix 4471')
+        self.assertEqual(recurring[1]['next_date'], str(date(2026, 1, 5) + timedelta(days=180)))
+
+    def test_unstable_amounts_and_short_series_are_ignored(self):
+        rows = [expense(date(2026, 1, 5) + timedelta(days=30 * n), 10 if n % 2 else 100, 'Shop') for n in range(6)]
+        rows += [expense(date(2026, 1, 5) + timedelta(days=30 * n), 10, 'Rare') for n in range(2)]
+        rows.sort()
+        self.assertEqual(detect_recurring(Ledger(rows), TODAY), [])
+
+    def test_empty_ledger(self):
+        self.assertEqual(detect_recurring(Ledger([]), TODAY), [])
+
+
+class LocalDaysTests(SimpleTestCase):
+    def test_days_follow_the_current_time_zone(self):
+        moments = [
+            datetime(2026, 9, 30, 21, 0, tzinfo=dt_timezone.utc),
+            datetime(2026, 3, 29, 0, 30, tzinfo=dt_timezone.utc),
+            datetime(2026, 3, 29, 23, 30, tzinfo=dt_timezone.utc),
+        ]
+        with timezone.override('Asia/Karachi'):
+            self.assertEqual([str(day) for day in _local_days(moments)], ['2026-10-01', '2026-03-29', '2026-03-30'])
+        with timezone.override('Europe/Berlin'):
+            # Clocks go forward at 01:00 UTC on 2026-03-29
+            self.assertEqual([str(day) for day in _local_days(moments)], ['2026-09-30', '2026-03-29', '2026-03-30'])
+        with timezone.override('America/New_York'):
+            self.assertEqual([str(day) for day in _local_days(moments)], ['2026-09-30', '2026-03-28', '2026-03-29'])
+
+
+class ForecastTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.client.force_authenticate(self.user)
+        account = Account.objects.create(bank=Bank.objects.create(user=self.user, name='HBL'), name='Current', number='1')
+        for month, amount in ((7, 100), (8, 200), (9, 300), (12, 5000)):
+            txn = Transaction.objects.create(user=self.user, account=account, amount=amount, type='withdrawal')
+            Transaction.objects.filter(pk=txn.pk).update(created_at=datetime(2026, month, 10, tzinfo=dt_timezone.utc))
+
+    def forecast(self):
+        with mock.patch('django.utils.timezone.localdate', return_value=TODAY):
+            response = self.client.get('/api/reports/forecast/', {'lookback': 3})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_future_dated_transactions_are_left_out(self):
+        report = self.forecast()
+        self.assertEqual(report['transactions_analyzed'], 3)
+        self.assertEqual(report['history'][-1]['month'], '2026-10')
+        self.assertEqual(
+            [month['expenses'] for month in report['history'][-4:]], [100.0, 200.0, 300.0, 0.0]
+        )
+        self.assertEqual(report['forecast']['average_monthly_net'], -200.0)
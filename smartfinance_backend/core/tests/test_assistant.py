@@ -0,0 +1,131 @@
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase
+from rest_framework.test import APITestCase
+
+from core.assistant import balance_at, normalize, parse
+from core.models import Account, Bank, Transaction
+from core.search import text_filter
+
+TODAY = date(2026, 10, 19)
+
+
+def ask(question):
+    return parse(normalize(question), TODAY)
+
+
+def spans(parsed):
+    return [(period.start, period.end) for period in parsed['periods']]
+
+
+class ParseTests(SimpleTestCase):
+    def test_an_explicit_date_is_a_one_day_period(self):
+        parsed = ask('How much did I spend on 2026-10-19?')
+        self.assertEqual(parsed['intent'], 'spending')
+        self.assertEqual(spans(parsed), [(date(2026, 10, 19), date(2026, 10, 20))])
+        self.assertIsNone(parsed['target'])
+
+    def test_dates_and_periods_keep_their_order(self):
+        parsed = ask('Compare spending on 5 october vs last month')
+        self.assertEqual(spans(parsed), [
+            (date(2026, 10, 5), date(2026, 10, 6)),
+            (date(2026, 9, 1), date(2026, 10, 1)),
+        ])
+
+    def test_an_impossible_date_is_reported(self):
+        parsed = ask('How much did I spend on 2026-02-30?')
+        self.assertEqual((parsed['bad_date'], parsed['periods']), ('2026-02-30', []))
+
+    def test_bare_may_is_not_a_period(self):
+        self.assertEqual(ask('May I see my spending on food')['periods'], [])
+        self.assertEqual(ask('How much did I spend in may')['periods'][0].start, date(2026, 5, 1))
+        self.assertEqual(ask('Spending mar 2025')['periods'][0].start, date(2025, 3, 1))
+        self.assertEqual(ask('Income in september')['periods'][0].start, date(2026, 9, 1))
+
+    def test_bare_numbers_are_not_years(self):
+        parsed = ask('Did I spend more than 2000 this month than last month?')
+        self.assertEqual(parsed['intent'], 'compare')
+        self.assertEqual(spans(parsed), [
+            (date(2026, 10, 1), date(2026, 11, 1)),
+            (date(2026, 9, 1), date(2026, 10, 1)),
+        ])
+        self.assertEqual(spans(ask('Spending in 2025')), [(date(2025, 1, 1), date(2026, 1, 1))])
+        self.assertEqual(spans(ask('Expenses for 2024')), [(date(2024, 1, 1), date(2025, 1, 1))])
+        self.assertEqual(ask('Spending march 2025')['periods'][0].start, date(2025, 3, 1))
+
+    def test_balance_target_and_date(self):
+        parsed = ask('What was the balance of my HBL Main account on 30 september?')
+        self.assertEqual(
+            (parsed['intent'], parsed['target'], parsed['date']), ('balance', 'hbl main', date(2026, 9, 30))
+        )
+
+
+def at(month, day):
+    return datetime(2026, month, day, 12, tzinfo=dt_timezone.utc)
+
+
+class AssistantQueryTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.client.force_authenticate(self.user)
+        self.main = self.account('HBL', 'Main', 500, at(1, 1))
+        self.savings = self.account('Meezan', 'Savings', 1000, at(10, 10))
+
+    def account(self, bank_name, name, balance, opened):
+        bank = Bank.objects.create(user=self.user, name=bank_name)
+        account = Account.objects.create(bank=bank, name=name, number=str(bank.id), balance=balance)
+        Account.objects.filter(pk=account.pk).update(created_at=opened)
+        return account
+
+    def book(self, when, amount, type='withdrawal', account=None, user=None, **fields):
+        txn = Transaction.objects.create(
+            user=user or self.user, account=account or self.main, amount=amount, type=type, **fields
+        )
+        Transaction.objects.filter(pk=txn.pk).update(created_at=when)
+        return txn
+
+    def query(self, question):
+        with mock.patch('django.utils.timezone.localdate', return_value=TODAY):
+            response = self.client.post('/api/assistant/query/', {'question': question})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_spending_on_a_date_covers_that_day_only(self):
+        self.book(at(10, 19), 30)
+        self.book(at(10, 18), 70)
+        data = self.query('How much did I spend on 2026-10-19?')['data']
+        self.assertEqual((data['total'], data['count']), (Decimal('30.00'), 1))
+
+    def test_balance_before_an_account_was_opened_leaves_it_out(self):
+        self.book(at(10, 12), 100, type='deposit')
+        with mock.patch('django.utils.timezone.localdate', return_value=TODAY):
+            self.assertEqual(balance_at(self.user, on_date=date(2026, 10, 11)), Decimal('1400.00'))
+            self.assertEqual(balance_at(self.user, on_date=date(2026, 10, 9)), Decimal('400.00'))
+            self.assertEqual(balance_at(self.user, [self.savings.id], date(2026, 10, 9)), Decimal('0.00'))
+
+    def test_balance_rolls_back_both_legs_of_a_transfer(self):
+        self.book(at(10, 15), -200, type='transfer', to_account=self.savings)
+        self.book(at(10, 15), 200, type='transfer', account=self.savings)
+        with mock.patch('django.utils.timezone.localdate', return_value=TODAY):
+            self.assertEqual(balance_at(self.user, [self.main.id], date(2026, 10, 14)), Decimal('700.00'))
+            self.assertEqual(balance_at(self.user, [self.savings.id], date(2026, 10, 14)), Decimal('800.00'))
+
+    def test_accounts_are_matched_by_bank_and_name_words(self):
+        data = self.query('What is the balance of HBL Main?')['data']
+        self.assertEqual([account['id'] for account in data['accounts']], [self.main.id])
+        self.assertEqual(data['balance'], Decimal('500.00'))
+        self.assertEqual(self.query('Balance of my Meezan accounts')['data']['accounts'][0]['id'], self.savings.id)
+        self.assertEqual(self.query('Balance of HBL Savings')['data']['accounts'], [])
+
+    def test_text_filter_is_scoped_to_the_user(self):
+        other = User.objects.create_user('bob', password='x')
+        other_account = Account.objects.create(bank=Bank.objects.create(user=other, name='HBL'), name='Main', number='9')
+        mine = self.book(at(10, 1), 10, description='Pizza night')
+        self.book(at(10, 1), 10, description='Pizza lunch', account=other_account, user=other)
+        scoped = Transaction.objects.filter(text_filter('pizza', connection.alias, self.user.id))
+        self.assertEqual(list(scoped.values_list('id', flat=True)), [mine.id])
+        self.assertEqual(Transaction.objects.filter(text_filter('pizza', connection.alias)).count(), 2)
@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from core.budgets import rebuild
+from core.models import Account, Bank, Budget, BudgetSpend, Category, Transaction
+
+
+class BudgetCounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.client.force_authenticate(self.user)
+        self.bank = Bank.objects.create(user=self.user, name='HBL')
+        self.current = Account.objects.create(bank=self.bank, name='Current', number='1', balance=1000)
+        self.savings = Account.objects.create(bank=self.bank, name='Savings', number='2', balance=1000)
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.total = Budget.objects.create(user=self.user, name='All', limit=500)
+        self.on_food = Budget.objects.create(user=self.user, name='Food', category=self.food, limit=100)
+        self.transfers = Budget.objects.create(user=self.user, name='Transfers', transaction_type='transfer', limit=100)
+
+    def spend(self, budget):
+        return sum(BudgetSpend.objects.filter(budget=budget).values_list('spent', flat=True), Decimal(0))
+
+    def post(self, **fields):
+        data = {'account_id': self.current.id, 'amount': '10', 'type': 'withdrawal', 'description': 'x', **fields}
+        return self.client.post('/api/transactions/', data)
+
+    def test_create_update_and_delete_adjust_the_counters(self):
+        response = self.post(amount='30', category_id=self.food.id)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((self.spend(self.total), self.spend(self.on_food)), (30, 30))
+
+        txn = Transaction.objects.get()
+        self.client.patch(f'/api/transactions/{txn.id}/', {'amount': '45', 'category': None}, format='json')
+        self.assertEqual((self.spend(self.total), self.spend(self.on_food)), (45, 0))
+
+        self.client.delete(f'/api/transactions/{txn.id}/')
+        self.assertEqual((self.spend(self.total), self.spend(self.on_food)), (0, 0))
+
+    def test_deposits_do_not_count(self):
+        self.post(type='deposit', amount='500')
+        self.assertEqual(self.spend(self.total), 0)
+
+    def test_insufficient_balance_is_rejected_without_counting(self):
+        response = self.post(amount='5000')
+        self.assertEqual((response.status_code, response.data), (400, {'error': 'Insufficient balance'}))
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(self.spend(self.total), 0)
+
+    def test_transfer_counts_its_outgoing_leg_only(self):
+        response = self.client.post(
+            f'/api/accounts/{self.current.id}/transfer/', {'to_account_id': self.savings.id, 'amount': '40'}
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((self.spend(self.transfers), self.spend(self.total)), (40, 0))
+
+    def test_queryset_deletes_release_their_spend(self):
+        for amount in ('10', '20', '30'):
+            self.post(amount=amount)
+        Transaction.objects.filter(amount__lt=25).delete()
+        self.assertEqual(self.spend(self.total), 30)
+
+    def test_deleting_an_account_releases_its_cascaded_spend(self):
+        self.post(amount='30')
+        self.post(account_id=self.savings.id, amount='20')
+        self.client.post(f'/api/accounts/{self.savings.id}/transfer/', {'to_account_id': self.current.id, 'amount': '5'})
+
+        self.client.delete(f'/api/accounts/{self.current.id}/')
+        self.assertEqual((self.spend(self.total), self.spend(self.transfers)), (20, 0))
+
+    def test_deleting_a_bank_releases_each_transaction_once(self):
+        self.post(amount='30')
+        self.client.post(f'/api/accounts/{self.current.id}/transfer/', {'to_account_id': self.savings.id, 'amount': '5'})
+        self.client.delete(f'/api/banks/{self.bank.id}/')
+        self.assertFalse(Account.objects.exists())
+        self.assertEqual((self.spend(self.total), self.spend(self.transfers)), (0, 0))
+
+    def test_deleting_a_category_keeps_the_other_counters(self):
+        self.post(amount='30', category_id=self.food.id)
+        self.client.delete(f'/api/categories/{self.food.id}/')
+        self.assertEqual(self.spend(self.total), 30)
+        self.assertFalse(Budget.objects.filter(pk=self.on_food.pk).exists())
+
+    def test_rebuild_matches_the_incremental_counters_with_one_scan_per_user(self):
+        self.post(amount='30', category_id=self.food.id)
+        self.post(amount='12')
+        self.client.post(f'/api/accounts/{self.current.id}/transfer/', {'to_account_id': self.savings.id, 'amount': '5'})
+        counters = sorted(BudgetSpend.objects.values_list('budget_id', 'month', 'spent'))
+
+        budgets = list(Budget.objects.all())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(rebuild(budgets), 3)
+        self.assertEqual(sum('FROM "core_transaction"' in query['sql'] for query in queries), 1)
+        self.assertEqual(sorted(BudgetSpend.objects.values_list('budget_id', 'month', 'spent')), counters)
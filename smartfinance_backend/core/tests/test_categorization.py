@@ -0,0 +1,119 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from core import categorization
+from core.categorization import compile_rules, get_matcher, validate_rule_pattern
+from core.models import Account, Bank, Category, CategoryRule, Transaction
+
+
+class RulePatternTests(TestCase):
+    def test_accepts_simple_regexes(self):
+        for pattern in ('uber.*eats', r'^salary\s+\d+', '[a-z]+ (foo|bar)', '(ab){2,5}x'):
+            self.assertIsNone(validate_rule_pattern('regex', pattern), pattern)
+
+    def test_rejects_catastrophic_backtracking(self):
+        for pattern in ('(a+)+$', '(a|aa)*', '(x*)*y', '.*a.*b.*c', '(?=x)y', 'a' * 101):
+            self.assertIsNotNone(validate_rule_pattern('regex', pattern), pattern)
+
+    def test_rejects_groups_that_clash_with_the_matcher(self):
+        self.assertIsNotNone(validate_rule_pattern('regex', '(?P<x>a)'))
+        self.assertIsNotNone(validate_rule_pattern('regex', r'(a)\1'))
+
+
+class MatcherTests(TestCase):
+    def test_highest_priority_rule_wins(self):
+        matcher = compile_rules([
+            (1, 10, 'substring', 'ab', None, None, 5),
+            (2, 20, 'substring', 'b', None, None, 1),
+            (3, 30, 'recipient', 'joe', None, None, 0),
+            (4, 40, 'amount_range', '', 500, None, 3),
+        ])
+        self.assertEqual(matcher.match('xaby'), 20)
+        self.assertEqual(matcher.match('xaby', 'Joe'), 30)
+        self.assertEqual(matcher.match('zzz', amount=-700), 40)
+        self.assertIsNone(matcher.match('zzz'))
+
+    def test_overlapping_literals_resolve_by_priority(self):
+        matcher = compile_rules([
+            (1, 10, 'substring', 'she', None, None, 3),
+            (2, 20, 'substring', 'he', None, None, 2),
+            (3, 30, 'substring', 'hers', None, None, 1),
+            (4, 40, 'substring', 'Shell', None, None, 4),
+        ])
+        self.assertEqual(matcher.match('ushers'), 30)
+        self.assertEqual(matcher.match('SHELL'), 20)
+        self.assertEqual(matcher.match('ushe'), 20)
+        self.assertIsNone(matcher.match('hrs'))
+
+    def test_regex_rules_only_win_on_priority(self):
+        matcher = compile_rules([
+            (1, 10, 'regex', r'uber\s*eats', None, None, 1),
+            (2, 20, 'substring', 'uber', None, None, 2),
+            (3, 30, 'regex', 'ub.r', None, None, 3),
+        ])
+        self.assertEqual(matcher.match('UBER Eats'), 10)
+        self.assertEqual(matcher.match('uber trip'), 20)
+        self.assertEqual(matcher.match('ubar'), 30)
+
+    def test_many_rules(self):
+        matcher = compile_rules([
+            (index, index, 'substring', f'shop{index}x', None, None, index) for index in range(1, 2001)
+        ])
+        self.assertEqual(matcher.match('paid SHOP1500X and shop1999x'), 1500)
+
+    def test_invalid_stored_regex_is_skipped(self):
+        matcher = compile_rules([(1, 10, 'regex', '(a+)+$', None, None, 1)])
+        self.assertIsNone(matcher.match('aaaa'))
+
+
+class MatcherCacheTests(TestCase):
+    def setUp(self):
+        categorization._matcher_cache.clear()
+        self.user = User.objects.create_user('alice')
+        self.category = Category.objects.create(user=self.user, name='Food')
+
+    def test_cached_until_rules_change(self):
+        CategoryRule.objects.create(user=self.user, category=self.category, rule_type='substring', pattern='pizza')
+        matcher = get_matcher(self.user.id)
+        self.assertIs(get_matcher(self.user.id), matcher)
+
+        CategoryRule.objects.create(user=self.user, category=self.category, rule_type='substring', pattern='burger')
+        updated = get_matcher(self.user.id)
+        self.assertIsNot(updated, matcher)
+        self.assertEqual(updated.match('Burger King'), self.category.id)
+
+    def test_cache_is_bounded(self):
+        users = [User.objects.create_user(f'user{index}') for index in range(3)]
+        with mock.patch.object(categorization, 'MATCHER_CACHE_SIZE', 2):
+            for user in users:
+                get_matcher(user.id)
+        self.assertEqual(list(categorization._matcher_cache), [users[1].id, users[2].id])
+
+
+class CategorizationApiTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.client.force_authenticate(self.user)
+        bank = Bank.objects.create(user=self.user, name='HBL')
+        self.account = Account.objects.create(bank=bank, name='Current', number='1', balance=1000)
+        self.food = Category.objects.create(user=self.user, name='Food')
+
+    def test_new_transactions_are_categorized(self):
+        response = self.client.post('/api/category-rules/', {
+            'category_id': self.food.id, 'rule_type': 'substring', 'pattern': 'pizza'
+        })
+        self.assertEqual(response.status_code, 201)
+        self.client.post('/api/transactions/', {
+            'account_id': self.account.id, 'amount': '20', 'type': 'withdrawal', 'description': 'PIZZA Hut'
+        })
+        self.assertEqual(Transaction.objects.get().category_id, self.food.id)
+
+    def test_unsafe_regex_is_rejected(self):
+        response = self.client.post('/api/category-rules/', {
+            'category_id': self.food.id, 'rule_type': 'regex', 'pattern': '(a+)+$'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pattern', response.data)
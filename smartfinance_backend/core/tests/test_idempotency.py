@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from core.models import Account, Bank, IdempotencyKey
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.client.force_authenticate(self.user)
+        bank = Bank.objects.create(user=self.user, name='HBL')
+        self.source = Account.objects.create(bank=bank, name='Current', number='1', balance=100)
+        self.target = Account.objects.create(bank=bank, name='Savings', number='2', balance=0)
+        self.url = f'/api/accounts/{self.source.id}/transfer/'
+
+    def transfer(self, amount='10.50', key='k1'):
+        return self.client.post(self.url, {'to_account_id': self.target.id, 'amount': amount}, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.transfer()
+        retry = self.transfer()
+        self.assertEqual((first.status_code, retry.status_code), (200, 200))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.source.refresh_from_db()
+        self.assertEqual(str(self.source.balance), '89.50')
+
+    def test_different_body_with_the_same_key_is_rejected(self):
+        self.transfer()
+        self.assertEqual(self.transfer(amount='11').status_code, 422)
+        self.source.refresh_from_db()
+        self.assertEqual(str(self.source.balance), '89.50')
+
+    def test_keys_are_per_user(self):
+        self.transfer()
+        other = User.objects.create_user('bob', password='x')
+        self.client.force_authenticate(other)
+        response = self.client.post(
+            '/api/transactions/', {'account_id': self.source.id, 'amount': '5', 'type': 'deposit'},
+            HTTP_IDEMPOTENCY_KEY='k1'
+        )
+        self.assertNotEqual(response.status_code, 422)
+
+    def interrupt(self, lease):
+        """Make the stored key look like its request is still running, with the lease ending after `lease`"""
+        self.transfer()
+        IdempotencyKey.objects.update(response_status=None, response_body=None, locked_until=timezone.now() + lease)
+
+    def test_running_request_blocks_retries(self):
+        self.interrupt(timedelta(minutes=1))
+        self.assertEqual(self.transfer().status_code, 409)
+
+    def test_retry_takes_over_a_crashed_request_after_its_lease(self):
+        self.interrupt(timedelta(seconds=-1))
+        response = self.transfer()
+        self.assertEqual(response.status_code, 200, response.data)
+        record = IdempotencyKey.objects.get()
+        self.assertEqual((record.response_status, record.locked_until), (200, None))
+        self.assertEqual(self.transfer()['Idempotent-Replayed'], 'true')
+
+
+class AnonymousIdempotencyTests(APITestCase):
+    payload = {'username': 'new', 'fullName': 'New User', 'email': 'new@example.com', 'password': 'secret12'}
+
+    def register(self, address, payload=None):
+        return self.client.post('/api/register/', payload or self.payload, HTTP_IDEMPOTENCY_KEY='r', REMOTE_ADDR=address)
+
+    def test_retry_from_the_same_client_is_replayed(self):
+        self.assertEqual(self.register('10.0.0.1').status_code, 201)
+        retry = self.register('10.0.0.1')
+        self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (201, 'true'))
+
+    def test_keys_of_other_clients_do_not_collide(self):
+        self.assertEqual(self.register('10.0.0.1').status_code, 201)
+        other = dict(self.payload, username='other', email='other@example.com')
+        response = self.register('10.0.0.2', other)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(User.objects.count(), 2)
@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from core import metrics
+from core.metrics import EXITED_FILE, MetricsRegistry
+
+REQUESTS = 'smartfinance_http_requests_total'
+LABELS = {'method': 'GET', 'route': 'snapshot-test', 'status': '200'}
+
+
+def dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=False)
+    def test_closed_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=True)
+    def test_public_when_opened_explicitly(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_PUBLIC=True)
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'# TYPE {REQUESTS} counter', response.content.decode())
+
+
+class MultiprocessSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        settings = override_settings(METRICS_MULTIPROC_DIR=self.directory, METRICS_FLUSH_INTERVAL=0.05)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, filename, value):
+        snapshot = {'counters': [[REQUESTS, sorted(LABELS.items()), value]], 'histograms': []}
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            json.dump(snapshot, f)
+
+    def total(self):
+        line = f'{REQUESTS}{{method="GET",route="snapshot-test",status="200"}}'
+        for row in metrics.render().splitlines():
+            if row.startswith(line):
+                return float(row.split()[-1])
+        return 0
+
+    def test_large_counters_keep_every_digit(self):
+        self.write(f'metrics-{dead_pid()}-0badf00d.json', 12345678)
+        self.assertIn(f'{REQUESTS}{{method="GET",route="snapshot-test",status="200"}} 12345678\n', metrics.render())
+
+    def test_every_process_gets_its_own_file(self):
+        self.assertNotEqual(MetricsRegistry().filename, MetricsRegistry().filename)
+
+    def test_files_of_dead_workers_are_folded_into_the_exited_totals(self):
+        self.write(f'metrics-{dead_pid()}-0badf00d.json', 5)
+        self.write(f'metrics-{dead_pid()}-0badf00e.json', 2)
+        self.assertEqual(self.total(), 7)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['.metrics-exited.lock', EXITED_FILE])
+        self.assertEqual(self.total(), 7)
+
+    def test_exiting_worker_folds_its_totals_and_removes_its_file(self):
+        worker = MetricsRegistry()
+        worker.inc(REQUESTS, LABELS, 3)
+        worker.flush(force=True)
+        self.assertIn(worker.filename, os.listdir(self.directory))
+        worker.close()
+        self.assertNotIn(worker.filename, os.listdir(self.directory))
+        self.assertEqual(self.total(), 3)
+        worker.flush(force=True)
+        self.assertNotIn(worker.filename, os.listdir(self.directory))
+
+    def test_idle_worker_writes_its_pending_metrics(self):
+        worker = MetricsRegistry()
+        worker.flush()
+        worker.inc(REQUESTS, LABELS, 4)
+        worker.flush()  # Within the interval: deferred to a timer
+        path = os.path.join(self.directory, worker.filename)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with open(path) as f:
+                if json.load(f)['counters']:
+                    break
+            time.sleep(0.02)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['counters'][0][2], 4)
+        worker.close()
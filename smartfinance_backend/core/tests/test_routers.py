@@ -0,0 +1,110 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core import routers
+from core.checks import check_shared_cache
+from core.models import Bank, ShardAssignment
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+FILE_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/x'}}
+
+
+@override_settings(DATABASE_REPLICAS=['replica_a', 'replica_b', 'replica_c'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()  # Pins left by the requests of other tests
+        self.router = routers.ReplicaRouter()
+        self.outside_atomic = mock.patch.object(routers, 'connections', {'default': mock.Mock(in_atomic_block=False)})
+        self.outside_atomic.start()
+        self.addCleanup(self.outside_atomic.stop)
+        self.addCleanup(routers.set_current_request, None)
+
+    def start_request(self, user_id, method='GET'):
+        request = mock.Mock(method=method, user=mock.Mock(is_authenticated=True, id=user_id))
+        del request._replica_pinned_user
+        routers.set_current_request(request)
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Bank), 'default')
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_one_replica_serves_the_whole_request(self):
+        for user_id in range(20):
+            self.start_request(user_id)
+            picked = {self.router.db_for_read(Bank) for _ in range(10)}
+            self.assertEqual(len(picked), 1)
+            self.assertIn(picked.pop(), ['replica_a', 'replica_b', 'replica_c'])
+
+    def test_writers_are_pinned_to_the_primary(self):
+        routers.pin_to_primary(7)
+        self.start_request(7)
+        self.assertEqual(self.router.db_for_read(Bank), 'default')
+        self.start_request(8, method='POST')
+        self.assertEqual(self.router.db_for_read(Bank), 'default')
+
+
+@override_settings(
+    DATABASE_SHARDS=['default', 'shard_1'], DATABASE_REPLICAS=['replica_a'],
+    SHARD_REPLICAS={'shard_1': ['shard_1_replica']},
+)
+class ShardReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ShardRouter()
+        connection = mock.Mock(in_atomic_block=False)
+        self.outside_atomic = mock.patch.object(routers, 'connections', {'default': connection, 'shard_1': connection})
+        self.outside_atomic.start()
+        self.addCleanup(self.outside_atomic.stop)
+        self.addCleanup(routers.set_current_request, None)
+        request = mock.Mock(method='GET', user=mock.Mock(is_authenticated=False))
+        request.resolver_match.namespace = ''
+        routers.set_current_request(request)
+
+    def test_ledger_reads_use_the_replicas_of_the_shard(self):
+        with routers.use_shard('shard_1'):
+            self.assertEqual(self.router.db_for_read(Bank), 'shard_1_replica')
+            self.assertEqual(self.router.db_for_write(Bank), 'shard_1')
+        self.assertEqual(self.router.db_for_read(Bank), 'replica_a')
+        self.assertIsNone(self.router.db_for_read(ShardAssignment))  # Left to ReplicaRouter
+
+    def test_instances_read_from_a_replica_are_written_to_its_primary(self):
+        bank = Bank(id=1)
+        bank._state.db = 'shard_1_replica'
+        self.assertEqual(self.router.db_for_write(Bank, instance=bank), 'shard_1')
+        other = Bank(id=2)
+        other._state.db = 'shard_1'
+        self.assertTrue(self.router.allow_relation(bank, other))
+
+    def test_admin_pages_read_the_shard_of_their_filter_or_object(self):
+        request = mock.Mock(method='GET', GET={})
+        request.resolver_match.namespace = 'admin'
+        routers.set_current_request(request)
+        for query, kwargs, shard in [
+            ({'shard': 'shard_1'}, {}, 'shard_1'),
+            ({'_changelist_filters': 'shard=shard_1&type=deposit'}, {'object_id': '5'}, 'shard_1'),
+            ({}, {'object_id': str(10 ** 12 + 5)}, 'shard_1'),
+            ({}, {'object_id': '5'}, 'default'),
+            ({'shard': 'unknown'}, {}, 'default'),
+        ]:
+            request.GET, request.resolver_match.kwargs = query, kwargs
+            self.assertEqual(self.router.db_for_write(Bank), shard, (query, kwargs))
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    @override_settings(DATABASE_REPLICAS=['replica_a'], CACHES=LOCMEM)
+    def test_replicas_with_a_process_local_cache_are_rejected(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['core.E001'])
+
+    @override_settings(DATABASE_REPLICAS=['replica_a'], CACHES=FILE_CACHE)
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(DATABASE_REPLICAS=[], SHARD_REPLICAS={'shard_1': ['shard_1_replica']}, CACHES=LOCMEM)
+    def test_shard_replicas_with_a_process_local_cache_are_rejected(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['core.E001'])
+
+    @override_settings(DATABASE_REPLICAS=[], CACHES=LOCMEM)
+    def test_no_replicas_need_no_shared_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
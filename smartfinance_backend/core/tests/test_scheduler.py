@@ -0,0 +1,112 @@
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from rest_framework.test import APITestCase
+
+from core.models import Account, Bank, RecurringTransaction, Transaction
+from core.scheduler import post_scheduled
+
+
+def at(month, day, hour=9):
+    return datetime(2026, month, day, hour, tzinfo=dt_timezone.utc)
+
+
+class SchedulerTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.client.force_authenticate(self.user)
+        bank = Bank.objects.create(user=self.user, name='HBL')
+        self.current = Account.objects.create(bank=bank, name='Current', number='1', balance=1000)
+        self.savings = Account.objects.create(bank=bank, name='Savings', number='2', balance=0)
+
+    def rule(self, **fields):
+        fields = {
+            'user': self.user, 'account': self.current, 'amount': 100, 'type': 'deposit',
+            'description': 'Salary', 'frequency': 'monthly', 'start_at': at(1, 31), **fields,
+        }
+        return RecurringTransaction.objects.create(next_run_at=fields['start_at'], **fields)
+
+    def balances(self):
+        self.current.refresh_from_db()
+        self.savings.refresh_from_db()
+        return self.current.balance, self.savings.balance
+
+    def test_missed_occurrences_are_caught_up_and_backdated(self):
+        rule = self.rule()
+        self.assertEqual(post_scheduled(now=at(4, 1)), (3, 0))
+        self.assertEqual(
+            list(Transaction.objects.order_by('created_at').values_list('created_at', flat=True)),
+            [at(1, 31), at(2, 28), at(3, 31)]
+        )
+        rule.refresh_from_db()
+        self.assertEqual((rule.occurrences_posted, rule.next_run_at), (3, at(4, 30)))
+        self.assertEqual(self.balances()[0], Decimal('1300'))
+        self.assertEqual(post_scheduled(now=at(4, 1)), (0, 0))
+
+    def test_debits_the_balance_cannot_cover_are_deferred(self):
+        rule = self.rule(type='withdrawal', amount=400, description='Rent')
+        with self.assertLogs('core.scheduler', 'WARNING'):
+            self.assertEqual(post_scheduled(now=at(4, 1)), (2, 1))
+        rule.refresh_from_db()
+        self.assertEqual((rule.occurrences_posted, rule.next_run_at), (2, at(3, 31)))
+        self.assertEqual(self.balances()[0], Decimal('200'))
+
+        Account.objects.filter(pk=self.current.pk).update(balance=500)
+        self.assertEqual(post_scheduled(now=at(4, 1)), (1, 0))
+        self.assertEqual(self.balances()[0], Decimal('100'))
+
+    def test_rules_past_their_end_are_deactivated(self):
+        rule = self.rule(end_at=at(2, 28))
+        self.assertEqual(post_scheduled(now=at(6, 1)), (2, 0))
+        rule.refresh_from_db()
+        self.assertFalse(rule.is_active)
+
+    def test_transfers_post_two_legs_like_the_transfer_endpoint(self):
+        self.rule(type='transfer', to_account=self.savings, amount=300, description='Save', start_at=at(3, 1))
+        self.assertEqual(post_scheduled(now=at(3, 2)), (2, 0))
+        legs = Transaction.objects.order_by('amount').values_list('account_id', 'to_account_id', 'amount')
+        self.assertEqual(list(legs), [
+            (self.current.id, self.savings.id, Decimal('-300')),
+            (self.savings.id, None, Decimal('300')),
+        ])
+        self.assertEqual(self.balances(), (Decimal('700'), Decimal('300')))
+
+
+class RecurringTransactionApiTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.client.force_authenticate(self.user)
+        bank = Bank.objects.create(user=self.user, name='HBL')
+        self.account = Account.objects.create(bank=bank, name='Current', number='1', balance=1000)
+
+    def create(self, **fields):
+        data = {
+            'account_id': self.account.id, 'amount': '100', 'type': 'deposit', 'description': 'Salary',
+            'frequency': 'monthly', 'start_at': '2026-01-31T09:00:00Z', **fields,
+        }
+        return self.client.post('/api/recurring-transactions/', data)
+
+    def test_transfer_to_the_source_account_is_rejected(self):
+        response = self.create(type='transfer', to_account_id=self.account.id)
+        self.assertEqual(response.status_code, 400)
+
+    def test_schedule_cannot_change(self):
+        rule_id = self.create().data['id']
+        response = self.client.patch(f'/api/recurring-transactions/{rule_id}/', {'frequency': 'daily'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_resuming_skips_the_occurrences_missed_while_paused(self):
+        rule_id = self.create().data['id']
+        self.client.patch(f'/api/recurring-transactions/{rule_id}/', {'is_active': False})
+        with mock.patch('django.utils.timezone.now', return_value=at(5, 15)):
+            response = self.client.patch(f'/api/recurring-transactions/{rule_id}/', {'is_active': True})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['next_run_at'], '2026-05-31T09:00:00Z')
+        self.assertEqual(post_scheduled(now=at(5, 15)), (0, 0))
+        self.assertEqual(post_scheduled(now=at(6, 1)), (1, 0))
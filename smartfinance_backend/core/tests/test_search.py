@@ -0,0 +1,83 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from core.models import Account, Bank, Transaction
+from core.search import FTS_TABLE, search_transactions
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.other = User.objects.create_user('bob', password='x')
+        self.client.force_authenticate(self.user)
+        bank = Bank.objects.create(user=self.user, name='HBL')
+        self.account = Account.objects.create(bank=bank, name='Current', number='1')
+        for description in ('Pizza Hut', 'pizza delivery pizza', 'Café payment', 'rent'):
+            self.add(self.user, description)
+        self.add(self.other, 'pizza')
+
+    def add(self, user, description, **fields):
+        return Transaction.objects.create(
+            user=user, account=self.account, amount=1, type='deposit', description=description, **fields
+        )
+
+    def search(self, query, **params):
+        return self.client.get('/api/transactions/search/', {'q': query, **params}).data
+
+    def test_prefix_and_accent_insensitive_matches(self):
+        self.assertEqual(self.search('piz')['count'], 2)
+        self.assertEqual(self.search('cafe')['count'], 1)
+        self.assertEqual(self.search('"*')['count'], 0)
+
+    def test_only_own_rows_are_returned(self):
+        self.assertNotIn('bob', [row['description'] for row in self.search('pizza')['results']])
+        total, results = search_transactions(self.other, 'pizza')
+        self.assertEqual((total, [txn.user_id for txn in results]), (1, [self.other.id]))
+
+    def test_user_id_is_not_searchable_as_text(self):
+        self.assertEqual(self.search(str(self.user.id))['count'], 0)
+
+    def test_best_match_first(self):
+        self.assertEqual(self.search('pizza')['results'][0]['description'], 'pizza delivery pizza')
+
+    def test_recipient_is_searched(self):
+        self.add(self.user, 'transfer', recipient_name='Imtiaz Store')
+        self.assertEqual(self.search('imtiaz')['count'], 1)
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/api/transactions/search/').status_code, 400)
+
+
+class SearchIndexSyncTests(TestCase):
+    """The SQLite triggers keep the FTS table in step with core_transaction"""
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite FTS5 index')
+        self.user = User.objects.create_user('alice')
+        bank = Bank.objects.create(user=self.user, name='HBL')
+        self.account = Account.objects.create(bank=bank, name='Current', number='1')
+
+    def indexed(self, term):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [f'"{term}"'])
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_insert_update_delete(self):
+        txn = Transaction.objects.create(
+            user=self.user, account=self.account, amount=1, type='deposit', description='rent'
+        )
+        self.assertEqual(self.indexed('rent'), [txn.id])
+
+        txn.description = 'pizza'
+        txn.save()
+        self.assertEqual(self.indexed('rent'), [])
+        self.assertEqual(self.indexed('pizza'), [txn.id])
+
+        Transaction.objects.filter(pk=txn.pk).update(recipient_name='Imtiaz')
+        self.assertEqual(self.indexed('imtiaz'), [txn.id])
+
+        txn.delete()
+        self.assertEqual(self.indexed('pizza'), [])
@@ -0,0 +1,142 @@
+from collections import Counter
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core import sharding
+from core.models import Account, Bank, Budget, BudgetSpend, RecurringTransaction, ShardAssignment, Transaction
+from core.routers import use_shard
+from core.scheduler import due_rule_ids
+from core.sharding import (
+    SHARD_ID_SPAN, ShardMoveError, fenced_user_ids, jump_hash, move_user, resume_moves, shard_for_user,
+)
+
+
+class JumpHashTests(SimpleTestCase):
+    def test_placement_matches_the_reference_implementation(self):
+        # Vectors of the paper's C++ code; changing them moves existing users on the next rebalance
+        vectors = [(1, 1, 0), (42, 57, 43), (0xDEAD10CC, 1, 0), (0xDEAD10CC, 666, 361), (256, 1024, 520)]
+        self.assertEqual([jump_hash(key, buckets) for key, buckets, _ in vectors], [b for _, _, b in vectors])
+        self.assertEqual([jump_hash(key, 4) for key in range(1, 11)], [0, 3, 3, 1, 1, 2, 0, 0, 2, 2])
+
+    def test_adding_a_bucket_only_moves_keys_to_it(self):
+        for buckets in (1, 3, 8):
+            moved = Counter(
+                (jump_hash(key, buckets), jump_hash(key, buckets + 1))
+                for key in range(10000) if jump_hash(key, buckets) != jump_hash(key, buckets + 1)
+            )
+            self.assertEqual({after for _, after in moved}, {buckets})
+            self.assertAlmostEqual(sum(moved.values()) / 10000, 1 / (buckets + 1), delta=0.02)
+
+
+@skipUnless(len(settings.DATABASE_SHARDS) >= 3, 'Run with SMARTFINANCE_SHARDS=3')
+@override_settings(SHARD_MOVE_DRAIN_SECONDS=0)
+class MoveUserTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.source, self.target = settings.DATABASE_SHARDS[1:3]
+        ShardAssignment.objects.create(user=self.user, alias=self.source)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with use_shard(self.source):
+            bank = Bank.objects.create(user=self.user, name='HBL')
+            self.account = Account.objects.create(bank=bank, name='Current', number='1', balance=100)
+            budget = Budget.objects.create(user=self.user, name='All', limit=50)
+            BudgetSpend.objects.create(budget=budget, month='2026-10-01', spent=10)
+            for amount in (10, 20):
+                Transaction.objects.create(user=self.user, account=self.account, amount=amount, type='withdrawal')
+
+    def ledger(self, alias):
+        return list(
+            Transaction.objects.using(alias).filter(user=self.user)
+            .values_list('account__bank__user_id', 'account__number', 'amount').order_by('amount')
+        )
+
+    def test_rows_are_copied_with_new_ids_and_the_source_is_deleted(self):
+        before = self.ledger(self.source)
+        self.assertEqual(move_user(self.user.id, self.target), 6)
+
+        self.assertEqual(shard_for_user(self.user.id), self.target)
+        self.assertEqual(self.ledger(self.target), before)
+        self.assertEqual(self.ledger(self.source), [])
+        lower, upper = sharding.id_range(self.target)
+        ids = Transaction.objects.using(self.target).values_list('id', flat=True)
+        self.assertTrue(all(lower <= pk < upper for pk in ids))
+        spend = BudgetSpend.objects.using(self.target).get()
+        self.assertEqual(spend.budget.user_id, self.user.id)
+        assignment = ShardAssignment.objects.get(user=self.user)
+        self.assertEqual((assignment.moving_to, assignment.stale_alias), ('', ''))
+        self.assertGreaterEqual(assignment.sync_floor, lower)
+
+    def test_a_write_during_the_copy_aborts_the_move(self):
+        copy = sharding._copy
+
+        def copy_racing_a_write(model, objs, alias, id_maps):
+            if model is Transaction:
+                with use_shard(self.source):
+                    Transaction.objects.create(user=self.user, account=self.account, amount=5, type='deposit')
+            return copy(model, objs, alias, id_maps)
+
+        with mock.patch.object(sharding, '_copy', copy_racing_a_write), self.assertRaises(ShardMoveError):
+            move_user(self.user.id, self.target)
+
+        self.assertEqual(shard_for_user(self.user.id), self.source)
+        self.assertEqual(len(self.ledger(self.source)), 3)
+        self.assertEqual(self.ledger(self.target), [])
+        self.assertEqual(fenced_user_ids(), set())
+
+    def test_writes_are_fenced_off_while_moving(self):
+        sharding.start_move(self.user.id, self.target)
+        data = {'account_id': self.account.id, 'amount': '1', 'type': 'deposit', 'description': 'x'}
+        self.assertEqual(self.client.post('/api/transactions/', data).status_code, 503)
+        self.assertEqual(self.client.get('/api/transactions/').status_code, 200)
+        self.assertEqual(fenced_user_ids(), {self.user.id})
+        with use_shard(self.source):
+            RecurringTransaction.objects.create(
+                user=self.user, account=self.account, amount=1, type='deposit', frequency='daily',
+                start_at=timezone.now(), next_run_at=timezone.now(),
+            )
+            self.assertEqual(due_rule_ids(timezone.now(), fenced_user_ids()), [])
+
+    def test_interrupted_moves_are_resumed(self):
+        with mock.patch.object(sharding, 'finish_stale_copy'):
+            move_user(self.user.id, self.target)  # Crashes before deleting the source
+        self.assertEqual(len(self.ledger(self.source)), 2)
+        self.assertEqual(resume_moves(), 1)
+        self.assertEqual(self.ledger(self.source), [])
+
+        sharding.start_move(self.user.id, self.source)  # Crashes while copying
+        self.assertEqual(resume_moves(), 1)
+        self.assertEqual((shard_for_user(self.user.id), len(self.ledger(self.source))), (self.source, 2))
+        self.assertEqual(self.ledger(self.target), [])
+
+    def test_new_ids_stay_within_the_target_range(self):
+        move_user(self.user.id, self.target)
+        account = Account.objects.using(self.target).get()
+        data = {'account_id': account.id, 'amount': '1', 'type': 'deposit', 'description': 'x'}
+        self.assertEqual(self.client.post('/api/transactions/', data).status_code, 201)
+        new = Transaction.objects.using(self.target).get(description='x')
+        self.assertEqual(new.id // SHARD_ID_SPAN, settings.DATABASE_SHARDS.index(self.target))
+
+    def test_admin_browses_and_edits_other_shards(self):
+        root = User.objects.create_superuser('root', password='x')
+        self.client.force_login(root)
+        response = self.client.get('/admin/core/transaction/', {'shard': self.source})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertEqual(self.client.get('/admin/core/transaction/').context['cl'].result_count, 0)
+
+        txn = Transaction.objects.using(self.source).order_by('amount').first()
+        url = f'/admin/core/transaction/{txn.id}/change/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.post(url, {
+            'user': self.user.id, 'account': self.account.id, 'amount': '15', 'type': 'withdrawal',
+            'description': 'edited', 'recipient_name': '', 'recipient_details': '',
+        })
+        txn.refresh_from_db()
+        self.assertEqual((txn.amount, txn.description), (15, 'edited'))
@@ -0,0 +1,122 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from core.models import Account, Bank, Category, ChangeLog, ChangeLogLock, Transaction
+
+
+class SyncTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.client.force_authenticate(self.user)
+        self.bank = Bank.objects.create(user=self.user, name='HBL')
+        self.account = Account.objects.create(bank=self.bank, name='Current', number='1')
+        self.category = Category.objects.create(user=self.user, name='Food')
+
+    def add(self, **fields):
+        return Transaction.objects.create(user=self.user, account=self.account, amount=1, type='deposit', **fields)
+
+    def sync(self, since=0):
+        response = self.client.get('/api/sync/', {'since': since})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_initial_sync_returns_everything(self):
+        txn = self.add()
+        data = self.sync()
+        self.assertEqual([row['id'] for row in data['updated']['transactions']], [txn.id])
+        self.assertEqual([row['id'] for row in data['updated']['categories']], [self.category.id])
+        self.assertFalse(data['reset'])
+
+    def test_token_returns_only_later_changes(self):
+        self.add()
+        token = self.sync()['token']
+        second = self.add(description='later')
+        data = self.sync(token)
+        self.assertEqual([row['id'] for row in data['updated']['transactions']], [second.id])
+        self.assertEqual(self.sync(data['token'])['updated']['transactions'], [])
+
+    def test_deletes_are_reported(self):
+        txn = self.add()
+        token = self.sync()['token']
+        txn_id = txn.id
+        txn.delete()
+        data = self.sync(token)
+        self.assertEqual(data['deleted']['transactions'], [txn_id])
+        self.assertEqual(data['updated']['transactions'], [])
+
+    def test_update_then_delete_reports_only_the_delete(self):
+        txn = self.add()
+        token = self.sync()['token']
+        txn.description = 'edited'
+        txn.save()
+        txn_id = txn.id
+        txn.delete()
+        data = self.sync(token)
+        self.assertEqual((data['deleted']['transactions'], data['updated']['transactions']), ([txn_id], []))
+
+    def test_category_delete_logs_uncategorized_transactions(self):
+        txn = self.add(category=self.category)
+        other = self.add()
+        token = self.sync()['token']
+        category_id = self.category.id
+        self.category.delete()
+        data = self.sync(token)
+        self.assertEqual(data['deleted']['categories'], [category_id])
+        self.assertEqual([row['id'] for row in data['updated']['transactions']], [txn.id])
+        self.assertIsNone(data['updated']['transactions'][0]['category_id'])
+        self.assertNotIn(other.id, [row['id'] for row in data['updated']['transactions']])
+
+    def test_cascaded_deletes_are_logged_in_bulk(self):
+        txns = [self.add() for _ in range(50)]
+        token = self.sync()['token']
+        bank_id, account_id = self.bank.id, self.account.id
+        with CaptureQueriesContext(connection) as queries:
+            self.bank.delete()
+        self.assertLess(len(queries), 30)
+        data = self.sync(token)
+        self.assertEqual(data['deleted']['banks'], [bank_id])
+        self.assertEqual(data['deleted']['accounts'], [account_id])
+        self.assertEqual(sorted(data['deleted']['transactions']), [txn.id for txn in txns])
+
+    def test_queryset_deletes_are_reported(self):
+        txns = [self.add() for _ in range(3)]
+        token = self.sync()['token']
+        Transaction.objects.filter(id__in=[txns[0].id, txns[1].id]).delete()
+        data = self.sync(token)
+        self.assertEqual(sorted(data['deleted']['transactions']), [txns[0].id, txns[1].id])
+
+    def test_writes_take_the_users_log_lock(self):
+        self.add()
+        self.assertTrue(ChangeLogLock.objects.filter(user=self.user).exists())
+
+    def test_token_outside_the_shard_range_resets(self):
+        self.add()
+        data = self.sync(-5)
+        self.assertTrue(data['reset'])
+        self.assertEqual(self.client.get('/api/sync/', {'since': 'x'}).status_code, 400)
+
+
+class CompactChangelogTests(APITestCase):
+    databases = '__all__'
+
+    def test_keeps_only_the_latest_entry_per_row(self):
+        user = User.objects.create_user('alice', password='x')
+        bank = Bank.objects.create(user=user, name='HBL')
+        account = Account.objects.create(bank=bank, name='Current', number='1')
+        txn = Transaction.objects.create(user=user, account=account, amount=1, type='deposit')
+        for description in ('a', 'b', 'c'):
+            txn.description = description
+            txn.save()
+        latest = ChangeLog.objects.filter(user=user, model='transaction').latest('id').id
+
+        call_command('compact_changelog', batch_size=1, stdout=StringIO())
+
+        entries = ChangeLog.objects.filter(user=user)
+        self.assertEqual(list(entries.filter(model='transaction').values_list('id', flat=True)), [latest])
+        self.assertEqual(entries.filter(model='bank').count(), 1)
+        self.assertEqual(entries.filter(model='account').count(), 1)
@@ -3,7 +3,9 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .views import (
     RegisterView, user_profile, BankViewSet, AccountViewSet,
-    TransactionViewSet, setup_banks, dashboard_data
+    TransactionViewSet, CategoryViewSet, CategoryRuleViewSet, RecurringTransactionViewSet,
+    BudgetViewSet,
+    setup_banks, dashboard_data, forecast_report, assistant_query, sync
 )
 
 # Create router for ViewSets
@@ -11,6 +13,10 @@ router = DefaultRouter()
 router.register(r'banks', BankViewSet, basename='bank')
 router.register(r'accounts', AccountViewSet, basename='account')
 router.register(r'transactions', TransactionViewSet, basename='transaction')
+router.register(r'categories', CategoryViewSet, basename='category')
+router.register(r'category-rules', CategoryRuleViewSet, basename='category-rule')
+router.register(r'recurring-transactions', RecurringTransactionViewSet, basename='recurring-transaction')
+router.register(r'budgets', BudgetViewSet, basename='budget')
 
 urlpatterns = [
     # Authentication
@@ -22,6 +28,9 @@ urlpatterns = [
     # Banking APIs
     path('setup-banks/', setup_banks, name='setup-banks'),
     path('dashboard/', dashboard_data, name='dashboard-data'),
+    path('reports/forecast/', forecast_report, name='forecast-report'),
+    path('sync/', sync, name='sync'),
+    path('assistant/query/', assistant_query, name='assistant-query'),
 
     # ViewSet URLs
     path('', include(router.urls)),
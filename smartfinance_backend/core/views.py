@@ -1,15 +1,30 @@
+import hmac
+from datetime import date
+from decimal import Decimal, InvalidOperation
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth.models import User
-from django.db import transaction
-from .models import Bank, Account, Transaction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+from .models import Bank, Account, Transaction, Category, CategoryRule, ChangeLog, RecurringTransaction, Budget
 from .serializers import (
     RegisterSerializer, BankSerializer, BankCreateSerializer,
     AccountSerializer, AccountCreateSerializer,
-    TransactionSerializer, TransactionCreateSerializer
+    TransactionSerializer, TransactionCreateSerializer,
+    CategorySerializer, CategoryRuleSerializer, RecurringTransactionSerializer, BudgetSerializer,
+    SyncBankSerializer, SyncAccountSerializer, SyncTransactionSerializer
 )
+from .categorization import get_matcher, recategorize
+from .search import search_transactions
+from .idempotency import idempotent
+from .analytics import get_forecast
+from .assistant import MAX_QUESTION_LENGTH, get_answer
+from .budgets import budget_statuses, month_start, rebuild, record_spend
+from .sharding import ledger_atomic, sync_token_range
+from . import metrics
 
 
 # --- User Registration View ---
@@ -18,6 +33,10 @@ class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
     permission_classes = [AllowAny]
 
+    @idempotent('register')
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
 
 # --- Get Logged-in User Profile ---
 @api_view(['GET'])
@@ -72,6 +91,7 @@ class AccountViewSet(viewsets.ModelViewSet):
         return AccountSerializer
 
     @action(detail=True, methods=['post'])
+    @idempotent('transfer')
     def transfer(self, request, pk=None):
         """Transfer money between accounts"""
         from_account = self.get_object()
@@ -86,13 +106,13 @@ class AccountViewSet(viewsets.ModelViewSet):
             )
 
         try:
-            amount = float(amount)
+            amount = Decimal(str(amount))
             if amount <= 0:
                 return Response(
                     {'error': 'Amount must be positive'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-        except ValueError:
+        except InvalidOperation:
             return Response(
                 {'error': 'Invalid amount'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -112,8 +132,12 @@ class AccountViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        matcher = get_matcher(request.user.id)
+        outgoing_description = f"Transfer to {to_account.name}"
+        incoming_description = f"Transfer from {from_account.name}"
+
         # Perform transfer
-        with transaction.atomic():
+        with ledger_atomic():
             from_account.balance -= amount
             from_account.save()
 
@@ -121,13 +145,14 @@ class AccountViewSet(viewsets.ModelViewSet):
             to_account.save()
 
             # Create transaction records
-            Transaction.objects.create(
+            outgoing = Transaction.objects.create(
                 user=request.user,
                 account=from_account,
                 amount=-amount,
                 type='transfer',
-                description=f"Transfer to {to_account.name}",
-                to_account=to_account
+                description=outgoing_description,
+                to_account=to_account,
+                category_id=matcher.match(outgoing_description, amount=amount)
             )
 
             Transaction.objects.create(
@@ -135,9 +160,12 @@ class AccountViewSet(viewsets.ModelViewSet):
                 account=to_account,
                 amount=amount,
                 type='transfer',
-                description=f"Transfer from {from_account.name}"
+                description=incoming_description,
+                category_id=matcher.match(incoming_description, amount=amount)
             )
 
+            record_spend([outgoing])
+
         return Response({
             'message': 'Transfer completed successfully',
             'from_account': AccountSerializer(from_account).data,
@@ -145,36 +173,79 @@ class AccountViewSet(viewsets.ModelViewSet):
         })
 
 
+class InsufficientBalance(Exception):
+    """Raised inside perform_create to roll back the new transaction"""
+
+
 # --- Transactions ViewSet ---
 class TransactionViewSet(viewsets.ModelViewSet):
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Transaction.objects.filter(user=self.request.user).select_related('account', 'account__bank', 'to_account', 'to_account__bank')
+        return Transaction.objects.filter(user=self.request.user).select_related('account', 'account__bank', 'to_account', 'to_account__bank', 'category')
 
     def get_serializer_class(self):
         if self.action == 'create':
             return TransactionCreateSerializer
         return TransactionSerializer
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search over descriptions and recipients"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'q is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', 20)), 1), 100)
+        except ValueError:
+            return Response(
+                {'error': 'page and page_size must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        total, results = search_transactions(
+            request.user, query, offset=(page - 1) * page_size, limit=page_size
+        )
+        return Response({
+            'count': total,
+            'page': page,
+            'page_size': page_size,
+            'results': TransactionSerializer(results, many=True).data
+        })
+
+    @idempotent('transaction-create')
+    def create(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except InsufficientBalance:
+            return Response(
+                {'error': 'Insufficient balance'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
     def perform_create(self, serializer):
-        """Handle transaction creation with balance updates"""
-        transaction_obj = serializer.save()
-        account = transaction_obj.account
+        """Handle transaction creation with balance and budget updates"""
+        with ledger_atomic():
+            transaction_obj = serializer.save()
+            account = transaction_obj.account
 
-        with transaction.atomic():
             if transaction_obj.type == 'deposit':
                 account.balance += transaction_obj.amount
                 account.save()
             elif transaction_obj.type == 'withdrawal':
                 if account.balance < transaction_obj.amount:
-                    raise ValueError("Insufficient balance")
+                    raise InsufficientBalance()
                 account.balance -= transaction_obj.amount
                 account.save()
             elif transaction_obj.type == 'transfer':
                 if account.balance < transaction_obj.amount:
-                    raise ValueError("Insufficient balance")
+                    raise InsufficientBalance()
                 # Subtract from source account
                 account.balance -= transaction_obj.amount
                 account.save()
@@ -185,14 +256,106 @@ class TransactionViewSet(viewsets.ModelViewSet):
                     transaction_obj.to_account.save()
             elif transaction_obj.type == 'external_transfer':
                 if account.balance < transaction_obj.amount:
-                    raise ValueError("Insufficient balance")
+                    raise InsufficientBalance()
                 account.balance -= transaction_obj.amount
                 account.save()
 
+            record_spend([transaction_obj])
+
+    def perform_update(self, serializer):
+        # Amount, type and category all decide which budgets a transaction counts towards
+        with ledger_atomic():
+            record_spend([Transaction.objects.get(pk=serializer.instance.pk)], sign=-1)
+            record_spend([serializer.save()])
+
+    def perform_destroy(self, instance):
+        with ledger_atomic():
+            record_spend([instance], sign=-1)
+            instance.delete()
+
+
+# --- Categories ViewSet ---
+class CategoryViewSet(viewsets.ModelViewSet):
+    serializer_class = CategorySerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Category.objects.filter(user=self.request.user)
+
+
+# --- Category Rules ViewSet ---
+class CategoryRuleViewSet(viewsets.ModelViewSet):
+    serializer_class = CategoryRuleSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return CategoryRule.objects.filter(user=self.request.user).select_related('category')
+
+    @action(detail=False, methods=['post'])
+    def apply(self, request):
+        """Re-run the user's rules over their existing transactions"""
+        overwrite = str(request.data.get('overwrite', '')).lower() in ('1', 'true', 'yes')
+        updated = recategorize(request.user.id, overwrite=overwrite)
+        return Response({
+            'message': 'Categorization completed successfully',
+            'updated': updated
+        })
+
+
+# --- Recurring Transactions ViewSet ---
+class RecurringTransactionViewSet(viewsets.ModelViewSet):
+    serializer_class = RecurringTransactionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return RecurringTransaction.objects.filter(user=self.request.user).select_related('account', 'to_account')
+
+
+# --- Budgets ViewSet ---
+class BudgetViewSet(viewsets.ModelViewSet):
+    serializer_class = BudgetSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Budget.objects.filter(user=self.request.user).select_related('category', 'account')
+
+    def perform_create(self, serializer):
+        # Count spending that happened before the budget existed
+        rebuild([serializer.save()])
+
+    def perform_update(self, serializer):
+        filters = ('category_id', 'account_id', 'transaction_type')
+        before = [getattr(serializer.instance, field) for field in filters]
+        budget = serializer.save()
+        if [getattr(budget, field) for field in filters] != before:
+            rebuild([budget])
+
+    @action(detail=False, methods=['get'])
+    def status(self, request):
+        """Spend of every budget for a month (default: current month)"""
+        month = request.query_params.get('month')
+        if month:
+            try:
+                year, month_number = map(int, month.split('-'))
+                month = date(year, month_number, 1)
+            except ValueError:
+                return Response(
+                    {'error': 'month must be in YYYY-MM format'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            month = month_start(timezone.now())
+
+        return Response({
+            'month': f'{month:%Y-%m}',
+            'budgets': budget_statuses(request.user, month)
+        })
+
 
 # --- Setup Banks API (Bulk bank and account creation) ---
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('setup-banks')
 def setup_banks(request):
     """Setup multiple banks with their accounts in one API call"""
     banks_data = request.data.get('banks', [])
@@ -206,7 +369,7 @@ def setup_banks(request):
     created_banks = []
 
     try:
-        with transaction.atomic():
+        with ledger_atomic():
             for bank_data in banks_data:
                 bank_name = bank_data.get('bankName')
                 accounts_data = bank_data.get('accounts', [])
@@ -284,5 +447,128 @@ def dashboard_data(request):
             'total_income': total_income,
             'total_expenses': total_expenses,
             'total_accounts': sum(bank.accounts.count() for bank in banks)
-        }
+        },
+        'budgets': budget_statuses(user)
+    })
+
+
+# --- Forecast Report API ---
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def forecast_report(request):
+    """Cash-flow history, burn rates, recurring payments and projected balance"""
+    try:
+        months = int(request.query_params.get('months', 6))
+        lookback = int(request.query_params.get('lookback', 3))
+    except ValueError:
+        return Response(
+            {'error': 'months and lookback must be integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if not 1 <= months <= 36 or not 1 <= lookback <= 24:
+        return Response(
+            {'error': 'months must be between 1 and 36 and lookback between 1 and 24'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response(get_forecast(request.user, months=months, lookback=lookback))
+
+
+# --- Assistant Query API ---
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def assistant_query(request):
+    """Answer a plain-language question about the user's own ledger"""
+    question = request.data.get('question')
+    if not isinstance(question, str) or not question.strip():
+        return Response(
+            {'error': 'question is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if len(question) > MAX_QUESTION_LENGTH:
+        return Response(
+            {'error': f'question must be at most {MAX_QUESTION_LENGTH} characters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response(get_answer(request.user, question.strip()))
+
+
+# --- Delta Sync API ---
+SYNC_PAGE_SIZE = 1000
+
+# ChangeLog.model -> (response key, owned queryset factory, serializer)
+SYNC_MODELS = {
+    'bank': ('banks', lambda user: Bank.objects.filter(user=user), SyncBankSerializer),
+    'account': ('accounts', lambda user: Account.objects.filter(bank__user=user), SyncAccountSerializer),
+    'category': ('categories', lambda user: Category.objects.filter(user=user), CategorySerializer),
+    'transaction': ('transactions', lambda user: Transaction.objects.filter(user=user), SyncTransactionSerializer),
+}
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync(request):
+    """Return rows changed or deleted since a change token, oldest change first"""
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        return Response(
+            {'error': 'since must be an integer token'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Tokens are per shard; one from before the user moved shards means starting over
+    lowest, highest = sync_token_range(request.user.id)
+    reset = since != 0 and not lowest <= since < highest
+    if reset:
+        since = 0
+
+    changes = list(
+        ChangeLog.objects.filter(user=request.user, id__gt=since)
+        .order_by('id')
+        .values_list('id', 'model', 'object_id', 'action')[:SYNC_PAGE_SIZE + 1]
+    )
+    has_more = len(changes) > SYNC_PAGE_SIZE
+    changes = changes[:SYNC_PAGE_SIZE]
+
+    # Only the latest change per row matters
+    latest = {}
+    for _, model, object_id, action_name in changes:
+        latest[(model, object_id)] = action_name
+
+    upserted = {model: [] for model in SYNC_MODELS}
+    deleted = {key: [] for key, _, _ in SYNC_MODELS.values()}
+    for (model, object_id), action_name in latest.items():
+        if action_name == 'delete':
+            deleted[SYNC_MODELS[model][0]].append(object_id)
+        else:
+            upserted[model].append(object_id)
+
+    updated = {}
+    for model, (key, queryset, serializer_class) in SYNC_MODELS.items():
+        rows = queryset(request.user).filter(id__in=upserted[model]) if upserted[model] else []
+        updated[key] = serializer_class(rows, many=True).data
+
+    return Response({
+        'token': changes[-1][0] if changes else since,
+        'reset': reset,
+        'has_more': has_more,
+        'updated': updated,
+        'deleted': deleted
     })
+
+
+# --- Prometheus Metrics ---
+def metrics_view(request):
+    """Prometheus text exposition of the metrics of all worker processes"""
+    token = settings.METRICS_TOKEN
+    if token:
+        if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+            return HttpResponseForbidden()
+    elif not settings.METRICS_PUBLIC:
+        return HttpResponseForbidden()
+    metrics.registry.flush(force=True)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -59,9 +62,25 @@ CORS_ALLOW_ALL_ORIGINS = True
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'EXCEPTION_HANDLER': 'core.metrics.exception_handler',
 }
 
+# Metrics: with several worker processes, point this at a directory shared by all
+# of them (cleared on deploy) so /metrics reports the sum over every worker.
+METRICS_MULTIPROC_DIR = os.environ.get('SMARTFINANCE_METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5  # seconds between snapshot writes per process
+# Scrapes must send "Authorization: Bearer <token>"; without a token /metrics answers 403
+# unless SMARTFINANCE_METRICS_PUBLIC=1 deliberately opens it (e.g. on a private network)
+METRICS_TOKEN = os.environ.get('SMARTFINANCE_METRICS_TOKEN')
+METRICS_PUBLIC = os.environ.get('SMARTFINANCE_METRICS_PUBLIC') == '1'
+
+# How long a stored Idempotency-Key response is replayed for retries
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # seconds
+# How long a request holds its key before a retry may assume it crashed and take over;
+# keep it above the slowest idempotent request
+IDEMPOTENCY_LOCK_TIMEOUT = 60  # seconds
+
 
 ROOT_URLCONF = 'smartfinance_backend.urls'
 
@@ -94,6 +113,51 @@ DATABASES = {
     }
 }
 
+# Replica pins must be visible to every worker process, so replicas need a shared cache:
+# SMARTFINANCE_CACHE_DIR shares one between the processes of a host, otherwise configure
+# Redis or Memcached here.
+if os.environ.get('SMARTFINANCE_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / os.environ['SMARTFINANCE_CACHE_DIR'],
+        }
+    }
+
+# Read replicas for core queries, e.g. SMARTFINANCE_REPLICA_DBS=db_replica.sqlite3
+# Add Postgres replicas as extra DATABASES entries and list their aliases here.
+DATABASE_REPLICAS = []
+for index, name in enumerate(filter(None, os.environ.get('SMARTFINANCE_REPLICA_DBS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / name.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+# Per-user shards for ledger data, e.g. SMARTFINANCE_SHARDS=4 adds db_shard_1..3.sqlite3;
+# 'default' is always shard 0 and keeps auth and the other global tables.
+DATABASE_SHARDS = ['default']
+for index in range(1, int(os.environ.get('SMARTFINANCE_SHARDS', '1'))):
+    alias = f'shard_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_shard_{index}.sqlite3',
+    }
+    DATABASE_SHARDS.append(alias)
+
+# Replicas of the other shards, e.g. {'shard_1': ['shard_1_replica']}; 'default' uses DATABASE_REPLICAS
+SHARD_REPLICAS = {}
+
+DATABASE_ROUTERS = ['core.routers.ShardRouter', 'core.routers.ReplicaRouter']
+
+# Seconds a shard move waits after fencing off a user's writes, for requests already writing
+SHARD_MOVE_DRAIN_SECONDS = 5
+
+# Seconds a user's reads stay on the primary after they write (read-your-writes)
+REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators